@@ -1,15 +1,10 @@
 import os
-import json
+import hashlib
 import pipes
-import re
 import signal
+import threading
 
-import spur
-
-from . import layouts, supervisors, registries
-
-
-_local = spur.LocalShell()
+from . import apps, parallel, uploads, readiness, tracing, layouts, supervisors, registries, fleets, shells, stacks, watching
 
 
 class RunningApplication(object):
@@ -29,45 +24,265 @@ class Deployer(object):
         self._registry = registry
         self._layout = layout
         self._supervisor = supervisor
+        self._registry_lock = threading.Lock()
+        self._deployments = {}
+        self._deployments_lock = threading.Lock()
+    
+    def deploy(self, path, params, snapshot=None):
+        app_config = apps.read_app_config(path)
+        with tracing.span("deploy", app=app_config["name"]):
+            self._deploy(path, params, snapshot, app_config)
     
-    def deploy(self, path, params):
-        app_config = self._read_app_config(path)
-        service_command = self._generate_command("service", params, app_config)
-        install_command = self._generate_command("install", params, app_config)
+    def _deploy(self, path, params, snapshot, app_config):
+        # Steps that don't depend on each other are overlapped: the supervisor
+        # is installed during the upload, and old releases are removed while
+        # the new release's provides are registered, once it's ready. Layouts
+        # that need a snapshot of the app create it themselves, so deploys to
+        # layouts that copy the app as it is don't pay for hashing it.
+        installing_supervisor = parallel.start(self._supervisor.install)
+        try:
+            self._deploy_while_installing_supervisor(path, params, snapshot, app_config, installing_supervisor)
+        finally:
+            installing_supervisor.wait()
+    
+    def _deploy_while_installing_supervisor(self, path, params, snapshot, app_config, installing_supervisor):
+        with tracing.span("resolve environment"):
+            dependencies = self._find_dependencies(app_config)
+            env = self._resolve_environment(params, app_config, dependencies)
+            missing_names = apps.missing_variables(app_config, env)
+            if missing_names:
+                raise apps.MissingVariablesError(app_config["name"], missing_names)
+        service_command = self._generate_command("service", env, app_config)
+        install_command = self._generate_command("install", env, app_config)
         
         service_name = "beach-{0}".format(app_config["name"])
         
-        app_path, username = self._layout.upload_service(service_name, path)
-        if install_command is not None:
-            self._layout.run(["sh", "-c", install_command], cwd=app_path)
+        with tracing.span("upload"):
+            release = self._layout.upload_service(
+                service_name,
+                path,
+                snapshot=snapshot,
+                install_command=install_command,
+            )
+        if not release.installed:
+            with tracing.span("install"):
+                if install_command is not None:
+                    self._install(path, release, install_command, app_config.get("install_cache"))
+                self._layout.mark_installed(release)
+        
+        with tracing.span("activate"):
+            app_path = self._layout.activate(release)
+        with tracing.span("set up service"):
+            installing_supervisor.get()
+            self._set_up_service(service_name, app_path, release.username, service_command, env, app_config)
+        with tracing.span("wait until ready"):
+            self._wait_until_ready(service_name, app_path, env, app_config)
         
-        self._set_up_service(service_name, app_path, username, service_command)
+        # Old releases are only removed once the new one is serving, since
+        # until then an old release may be the only one that works
+        removing_old_releases = parallel.start(self._remove_old_releases, release)
+        try:
+            with tracing.span("register provides"):
+                self._register_provides(env, app_config)
+        finally:
+            removing_old_releases.wait()
+        removing_old_releases.get()
+        
+        self._record_deployment(_Deployment(
+            path=path,
+            params=params,
+            app_config=app_config,
+            dependencies=dependencies,
+            install_command=install_command,
+            service_name=service_name,
+            app_path=app_path,
+            username=release.username,
+        ))
     
-    def _generate_command(self, command_name, params, app_config):
-        command = app_config.get(command_name)
-        if command is None:
-            return None
+    def update_dependents(self):
+        """
+        Re-apply the services deployed by this deployer whose dependencies
+        now provide different values for the variables they use, setting them
+        all up at once.
         
-        # TODO: Read params from app config to ensure all are satisfied.
-        env = params.copy()
-        for dependency_name in app_config.get("dependencies", []):
-            service = self._registry.find_service(dependency_name)
-            for key, value in service.provides.items():
-                env["{0}.{1}".format(dependency_name, key)] = value
+        Apps whose install command would change are redeployed in full.
+        Apps with a dependency that is no longer registered, or that no
+        longer provides a value the app uses, are left as they are.
         
+        Returns the names of the apps that were updated.
+        """
+        with self._deployments_lock:
+            deployments = list(self._deployments.values())
         
+        dependency_names = sorted(set(
+            name
+            for deployment in deployments
+            for name in deployment.dependencies
+        ))
+        if not dependency_names:
+            return []
+        services = self._registry.find_services(dependency_names)
         
-        def replace_variable(matchobj):
-            return pipes.quote(env[matchobj.group(1)])
+        updated_names = []
+        updates = []
+        for deployment in deployments:
+            if any(services[name] is None for name in deployment.dependencies):
+                continue
+            dependencies = dict(
+                (name, services[name].provides)
+                for name in deployment.dependencies
+            )
+            if dependencies == deployment.dependencies:
+                continue
+            
+            app_config = deployment.app_config
+            env = self._resolve_environment(deployment.params, app_config, dependencies)
+            if apps.missing_variables(app_config, env):
+                continue
+            previous_env = self._resolve_environment(deployment.params, app_config, deployment.dependencies)
+            if apps.used_values(app_config, env) == apps.used_values(app_config, previous_env):
+                self._record_deployment(deployment.with_dependencies(dependencies))
+                continue
+            updated_names.append(app_config["name"])
+            if self._generate_command("install", env, app_config) != deployment.install_command:
+                self.deploy(deployment.path, deployment.params)
+            else:
+                updates.append((deployment, dependencies, env))
         
-        return re.sub(r"\$\{([^}]+)\}", replace_variable, command)
+        if updates:
+            with tracing.span("set up services", services=len(updates)):
+                self._supervisor.set_up_many([
+                    {
+                        "service_name": deployment.service_name,
+                        "cwd": deployment.app_path,
+                        "username": deployment.username,
+                        "command": self._generate_command("service", env, deployment.app_config),
+                        "reload_signal": deployment.app_config.get("reload_signal"),
+                        "listen_port": _listen_port(env, deployment.app_config),
+                    }
+                    for deployment, dependencies, env in updates
+                ])
+            for deployment, dependencies, env in updates:
+                self._wait_until_ready(deployment.service_name, deployment.app_path, env, deployment.app_config)
+                self._register_provides(env, deployment.app_config)
+                self._record_deployment(deployment.with_dependencies(dependencies))
+        
+        return updated_names
+    
+    def _record_deployment(self, deployment):
+        with self._deployments_lock:
+            self._deployments[deployment.app_config["name"]] = deployment
+    
+    def _install(self, path, release, install_command, install_cache_config):
+        if install_cache_config is None:
+            self._layout.run(["sh", "-c", install_command], cwd=release.path)
+        else:
+            cache_key = _install_cache_key(path, install_command, install_cache_config.get("keys", []))
+            output_paths = install_cache_config.get("paths", [])
+            if not output_paths:
+                raise ValueError("install_cache of {0} must list the paths that install writes".format(path))
+            if not self._layout.restore_install_cache(release, cache_key, output_paths):
+                self._layout.run(["sh", "-c", install_command], cwd=release.path)
+            # Saved even when restored, so the cache outlives the release that
+            # the outputs were first installed in
+            self._layout.save_install_cache(release, cache_key)
+    
+    def _find_dependencies(self, app_config):
+        dependency_names = app_config.get("dependencies", [])
+        if not dependency_names:
+            return {}
+        services = self._registry.find_services(dependency_names)
+        # Dependencies that aren't registered provide nothing, so the values
+        # the app needs from them are reported as missing
+        dependencies = {}
+        for dependency_name in dependency_names:
+            service = services[dependency_name]
+            dependencies[dependency_name] = {} if service is None else service.provides
+        return dependencies
+    
+    def _resolve_environment(self, params, app_config, dependencies=None):
+        if dependencies is None:
+            dependencies = self._find_dependencies(app_config)
+        return apps.Environment(params, dependencies)
     
-    def _set_up_service(self, service_name, app_path, username, command):
-        self._supervisor.install()
-        self._supervisor.set_up(service_name, cwd=app_path, username=username, command=command)
+    def _generate_command(self, command_name, env, app_config):
+        command = app_config.get(command_name)
+        if command is None:
+            return None
         
+        return apps.render(command, env, quote=pipes.quote)
+    
+    def _remove_old_releases(self, release):
+        with tracing.span("remove old releases"):
+            self._layout.remove_old_releases(release)
+    
+    def _set_up_service(self, service_name, app_path, username, command, env, app_config):
+        self._supervisor.set_up(
+            service_name,
+            cwd=app_path,
+            username=username,
+            command=command,
+            reload_signal=app_config.get("reload_signal"),
+            listen_port=_listen_port(env, app_config),
+        )
+        
+    
+    def _wait_until_ready(self, service_name, app_path, env, app_config):
+        readiness_config = app_config.get("readiness")
+        if readiness_config is not None:
+            probe = readiness.read_probe(readiness_config, env)
+            readiness.wait_until_ready(self._layout.run, service_name, probe, cwd=app_path)
     
-    def _read_app_config(self, path):
-        with open(os.path.join(path, "beach.json")) as beach_config_file:
-            beach_config = json.load(beach_config_file)
-        return beach_config
+    def _register_provides(self, env, app_config):
+        provides_template = app_config.get("provides")
+        if provides_template is not None and self._registry is not None:
+            provides = dict(
+                (key, apps.render(value, env))
+                for key, value in provides_template.items()
+            )
+            with self._registry_lock:
+                self._registry.register(app_config["name"], provides)
+
+
+def _listen_port(env, app_config):
+    listen = app_config.get("listen")
+    if listen is None:
+        return None
+    else:
+        return int(apps.render(str(listen), env))
+
+
+class _Deployment(object):
+    def __init__(self, path, params, app_config, dependencies, install_command, service_name, app_path, username):
+        self.path = path
+        self.params = params
+        self.app_config = app_config
+        self.dependencies = dependencies
+        self.install_command = install_command
+        self.service_name = service_name
+        self.app_path = app_path
+        self.username = username
+    
+    def with_dependencies(self, dependencies):
+        return _Deployment(
+            path=self.path,
+            params=self.params,
+            app_config=self.app_config,
+            dependencies=dependencies,
+            install_command=self.install_command,
+            service_name=self.service_name,
+            app_path=self.app_path,
+            username=self.username,
+        )
+
+
+def _install_cache_key(path, install_command, key_paths):
+    hasher = hashlib.sha1()
+    hasher.update(install_command.encode("utf8"))
+    for key_path in key_paths:
+        hasher.update(b"\0" + key_path.encode("utf8") + b"\0")
+        full_path = os.path.join(path, key_path)
+        if os.path.exists(full_path):
+            with open(full_path, "rb") as key_file:
+                hasher.update(key_file.read())
+    return hasher.hexdigest()
@@ -0,0 +1,120 @@
+import os
+import json
+import re
+
+
+def read_app_config(path):
+    with open(os.path.join(path, "beach.json")) as beach_config_file:
+        beach_config = json.load(beach_config_file)
+    return beach_config
+
+
+def render(template, env, quote=None):
+    return compile_template(template).render(env, quote=quote)
+
+
+_variable_pattern = re.compile(r"\$\{([^}]+)\}")
+
+_templates = {}
+
+
+def compile_template(template):
+    """
+    Parse template, reusing the result for templates already parsed.
+    """
+    compiled = _templates.get(template)
+    if compiled is None:
+        compiled = _templates[template] = Template(template)
+    return compiled
+
+
+class Template(object):
+    def __init__(self, template):
+        parts = _variable_pattern.split(template)
+        self.variables = parts[1::2]
+        literals = [literal.replace("{", "{{").replace("}", "}}") for literal in parts[0::2]]
+        self._format = literals[0] + "".join(
+            "{{{0}}}{1}".format(index, literal)
+            for index, literal in enumerate(literals[1:])
+        )
+    
+    def render(self, env, quote=None):
+        if quote is None:
+            values = [env[name] for name in self.variables]
+        else:
+            values = [quote(env[name]) for name in self.variables]
+        return self._format.format(*values)
+
+
+class Environment(object):
+    """
+    The values that templates are rendered with: each value provided by a
+    dependency as <dependency>.<key>, then the params. Neither is copied.
+    """
+    
+    def __init__(self, params, dependencies=None):
+        self._params = params
+        self._dependencies = dependencies or {}
+    
+    def __getitem__(self, name):
+        # Dependency names may themselves contain dots, so each dot is tried
+        # as the end of the dependency name
+        index = name.find(".")
+        while index != -1:
+            provides = self._dependencies.get(name[:index])
+            if provides is not None and name[index + 1:] in provides:
+                return provides[name[index + 1:]]
+            index = name.find(".", index + 1)
+        return self._params[name]
+    
+    def __contains__(self, name):
+        try:
+            self[name]
+            return True
+        except KeyError:
+            return False
+
+
+def missing_variables(app_config, env):
+    """
+    Returns the sorted names of the params that the app requires, and the
+    variables used in its templates, that env has no value for.
+    """
+    names = set(app_config.get("require", {}))
+    for template in _app_templates(app_config):
+        names.update(compile_template(template).variables)
+    return sorted(name for name in names if name not in env)
+
+
+def used_values(app_config, env):
+    """
+    Returns the values in env of the variables used in the app's templates,
+    keyed by variable name. env must have a value for each of them.
+    """
+    values = {}
+    for template in _app_templates(app_config):
+        for name in compile_template(template).variables:
+            values[name] = env[name]
+    return values
+
+
+def _app_templates(app_config):
+    for command_name in ["install", "service"]:
+        if app_config.get(command_name) is not None:
+            yield app_config[command_name]
+    if "listen" in app_config:
+        yield str(app_config["listen"])
+    readiness_config = app_config.get("readiness", {})
+    for key in ["port", "url", "command"]:
+        if key in readiness_config:
+            yield str(readiness_config[key])
+    for value in app_config.get("provides", {}).values():
+        yield value
+
+
+class MissingVariablesError(Exception):
+    def __init__(self, app_name, names):
+        super(MissingVariablesError, self).__init__(
+            "Missing values for {0}: {1}".format(app_name, ", ".join(names)))
+        self.app_name = app_name
+        self.names = names
@@ -0,0 +1,37 @@
+import time
+
+from . import parallel, uploads
+
+
+def deploy(targets, path, params, max_workers):
+    """
+    Deploy the app at path to many targets at once.
+    
+    targets is a list of (name, deployer) pairs. The app is hashed once and
+    the snapshot is shared by all targets, each of which is then sent only
+    the content it doesn't already have.
+    """
+    app_snapshot = uploads.create_snapshot(path)
+    
+    def deploy_to_target(target):
+        name, deployer = target
+        start_time = time.time()
+        deployer.deploy(path, params=params, snapshot=app_snapshot)
+        return time.time() - start_time
+    
+    results = parallel.map_bounded(deploy_to_target, targets, max_workers=max_workers)
+    return [
+        TargetResult(name=name, seconds=result.value, error=result.error)
+        for (name, deployer), result in zip(targets, results)
+    ]
+
+
+class TargetResult(object):
+    def __init__(self, name, seconds, error):
+        self.name = name
+        self.seconds = seconds
+        self.error = error
+    
+    @property
+    def succeeded(self):
+        return self.error is None
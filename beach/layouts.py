@@ -1,84 +1,319 @@
 import os
+import hashlib
 import posixpath
 import uuid
-import shutil
 import subprocess
-import hashlib
 import time
 
-import spur
-import tempman
-
-from . import contexts, tarballs
-
-_local = spur.LocalShell()
+from . import contexts, parallel, tracing, uploads
 
 
 class TemporaryLayout(contexts.Closeable):
     def __init__(self):
+        import spur
+        import tempman
+        
         self._dir = tempman.create_temp_dir()
-        self.run = _local.run
+        self.run = spur.LocalShell().run
     
     def close(self):
         self._dir.close()
     
-    def upload_service(self, service_name, path):
+    def upload_service(self, service_name, path, snapshot=None, install_command=None):
         destination = os.path.join(self._dir.path, service_name)
         subprocess.check_call(["cp", "-rT", path, destination])
-        return destination, None
+        return Release(destination, username=None)
+    
+    def mark_installed(self, release):
+        pass
+    
+    def activate(self, release):
+        return release.path
+    
+    def remove_old_releases(self, release):
+        pass
+    
+    def restore_install_cache(self, release, key, paths):
+        return False
+    
+    def save_install_cache(self, release, key):
+        pass
 
 
 class UserPerService(contexts.Closeable):
-    def __init__(self, shell):
+    def __init__(self, shell, incremental=True, compression=None, retention=None):
         self._shell = shell
+        self._incremental = incremental
+        self._compression = compression
+        self._retention = retention
         self.run = shell.run
     
     def close(self):
         pass
     
-    def upload_service(self, service_name, path):
-        self._create_user_if_missing(service_name)
+    def upload_service(self, service_name, path, snapshot=None, install_command=None):
+        creating_user = parallel.start(self._create_user_and_find_home, service_name)
+        try:
+            if snapshot is None:
+                snapshot = uploads.create_snapshot(path)
+        finally:
+            creating_user.wait()
+        home_path = creating_user.get()
+        release_key = _release_key(snapshot, install_command)
         
-        with tarballs.create_temp_tarball(path) as local_tarball:
-            service_hash = _file_hash(local_tarball)
-            local_tarball.seek(0)
-            
-            home_path = self._shell.run(["su", service_name, "-", "-c" "sh -c 'echo $HOME'"]).output.strip()
-            app_path = self._path_join(home_path, "{0}-{1}".format(int(time.time()), service_hash[:10]))
-            self._shell.run(["mkdir", "-p", app_path])
-            
-            self._upload_tarball(local_tarball, app_path)
+        with tracing.span("find release"):
+            existing_path = self._releases(home_path).find(release_key)
+        if existing_path is not None:
+            return Release(existing_path, username=service_name, key=release_key, installed=True)
         
-        return app_path, service_name
+        staging_path = self._path_join(home_path, ".beach-staging-{0}".format(uuid.uuid4()))
+        with tracing.span("upload release"):
+            service_hash = self._uploader(home_path).upload(path, staging_path, snapshot=snapshot)
         
-    def _create_user_if_missing(self, username):
-        if self._shell.run(["id", username], allow_error=True).return_code != 0:
-            self._shell.run(["adduser", "--disabled-password", "--gecos", "", username])
-    
-    def _upload_tarball(self, local_tarball, remote_path):
-        remote_tarball_path = os.path.join("/tmp", str(uuid.uuid4()))
-        with self._shell.open(remote_tarball_path, "w") as remote_tarball:
-            shutil.copyfileobj(local_tarball, remote_tarball)
+        app_path = self._path_join(home_path, "{0}-{1}".format(int(time.time()), service_hash[:10]))
+        self._shell.run(["mv", staging_path, app_path])
         
-        self._shell.run(["mkdir", "-p", remote_path])
-        self._shell.run(
-            [
-                "tar", "xzf", remote_tarball_path,
-                "--strip-components=1",
-            ],
-            cwd=remote_path,
+        return Release(app_path, username=service_name, key=release_key)
+    
+    def mark_installed(self, release):
+        home_path = posixpath.dirname(release.path)
+        self._releases(home_path).add(release.key, release.path)
+    
+    def activate(self, release):
+        """
+        Atomically point the current symlink in the service's home at the
+        release, and return the path of the symlink. Services run from the
+        symlink so that their run files don't change between releases.
+        """
+        home_path = posixpath.dirname(release.path)
+        current_path = self._path_join(home_path, "current")
+        self._shell.run(["sh", "-c", _activate_release_script, "sh", release.path, current_path])
+        return current_path
+    
+    def remove_old_releases(self, release):
+        """
+        Apply the retention policy, if any, to the releases of the service
+        that release belongs to.
+        """
+        if self._retention is not None:
+            self._retention.apply(self._shell, [posixpath.dirname(release.path)])
+    
+    def collect_garbage(self, retention=None):
+        """
+        Apply the retention policy to the releases of every service on the
+        host with a single remote command. Returns the paths removed.
+        """
+        if retention is None:
+            retention = self._retention
+        return retention.apply(self._shell, homes=None)
+    
+    def restore_install_cache(self, release, key, paths):
+        home_path = posixpath.dirname(release.path)
+        cached_release_path = self._install_cache(home_path).find(key)
+        if cached_release_path is None:
+            return False
+        
+        result = self._shell.run(
+            ["sh", "-c", _restore_install_cache_script, "sh", cached_release_path, release.path] + paths,
+            allow_error=True,
         )
-        self._shell.run(["rm", remote_tarball_path])
+        return result.return_code == 0
+    
+    def save_install_cache(self, release, key):
+        home_path = posixpath.dirname(release.path)
+        self._install_cache(home_path).add(key, release.path)
+    
+    def _releases(self, home_path):
+        return ReleaseManifest(self._shell, self._path_join(home_path, ".beach", "releases"))
+    
+    def _install_cache(self, home_path):
+        return ReleaseManifest(self._shell, self._path_join(home_path, ".beach", "install-cache"))
+    
+    def _uploader(self, home_path):
+        if self._incremental:
+            store_path = self._path_join(home_path, ".beach", "objects")
+            return uploads.ContentAddressedUploader(self._shell, store_path, compression=self._compression)
+        else:
+            return uploads.TarballUploader(self._shell, compression=self._compression)
+        
+    def _create_user_and_find_home(self, username):
+        result = self._shell.run(["sh", "-c", _create_user_script, "sh", username])
+        return result.output.strip().decode("utf8")
     
     def _path_join(self, *args):
         return posixpath.join(*args)
 
 
-def _file_hash(fileobj):
+def read_retention(config):
+    if config is None:
+        return None
+    max_age_days = config.get("max_age_days")
+    return Retention(
+        keep=config.get("keep"),
+        max_age=None if max_age_days is None else max_age_days * 24 * 60 * 60,
+    )
+
+
+class Retention(object):
+    """
+    Which releases of a service to keep. A release is removed only if it
+    is older than the newest keep releases and older than max_age seconds.
+    The live release is always kept.
+    
+    Removing releases also drops them from the release and install cache
+    manifests, along with leftover staging directories and stored objects
+    that are no longer used by any release.
+    """
+    
+    def __init__(self, keep=None, max_age=None):
+        if keep is None and max_age is None:
+            raise ValueError("Retention needs at least one of keep and max_age")
+        self.keep = keep
+        self.max_age = max_age
+    
+    def apply(self, shell, homes):
+        # With no homes, the script finds the homes of all beach services
+        args = [_optional_int(self.keep), _optional_int(self.max_age)] + (homes or [])
+        output = shell.run(["sh", "-c", _collect_garbage_script, "sh"] + args).output
+        return output.decode("utf8").splitlines()
+
+
+def _optional_int(value):
+    return "" if value is None else str(int(value))
+
+
+class Release(object):
+    def __init__(self, path, username, key=None, installed=False):
+        self.path = path
+        self.username = username
+        self.key = key
+        self.installed = installed
+
+
+class ReleaseManifest(object):
+    """
+    A file on the target mapping keys to release directories, such as the
+    releases that have been fully installed or that hold cached install
+    outputs. Releases whose directories have been removed are never found.
+    """
+    
+    def __init__(self, shell, path):
+        self._shell = shell
+        self._path = path
+    
+    def find(self, key):
+        output = self._shell.run(["sh", "-c", _find_release_script, "sh", self._path, key]).output
+        path = output.strip().decode("utf8")
+        return path or None
+    
+    def add(self, key, path):
+        self._shell.run(["sh", "-c", _add_release_script, "sh", self._path, key, path])
+
+
+_find_release_script = """
+[ -f "$1" ] || exit 0
+while read -r key path; do
+    if [ "$key" = "$2" ] && [ -d "$path" ]; then
+        release_path="$path"
+    fi
+done < "$1"
+echo "$release_path"
+"""
+
+_add_release_script = """set -e
+mkdir -p "$(dirname "$1")"
+echo "$2 $3" >> "$1"
+"""
+
+
+_create_user_script = """set -e
+if ! id "$1" > /dev/null 2>&1; then
+    adduser --disabled-password --gecos "" "$1" > /dev/null
+fi
+getent passwd "$1" | cut -d: -f6
+"""
+
+
+# Renaming over the old symlink is atomic, whereas ln -sf unlinks it first
+_activate_release_script = """set -e
+ln -sfn "$1" "$2.tmp"
+mv -T "$2.tmp" "$2"
+"""
+
+
+_collect_garbage_script = """set -e
+keep="$1"
+max_age="$2"
+shift 2
+if [ "$#" -eq 0 ]; then
+    set -- $(getent passwd | awk -F: '$1 ~ /^beach-/ { print $6 }')
+fi
+now="$(date +%s)"
+for home in "$@"; do
+    [ -d "$home" ] || continue
+    live="$(readlink "$home/current" || true)"
+    index=0
+    for release in $(ls -1 "$home" | grep -E '^[0-9]+-[0-9a-f]+$' | sort -rn); do
+        index=$(($index + 1))
+        path="$home/$release"
+        [ "$path" != "$live" ] || continue
+        [ -z "$keep" ] || [ "$index" -gt "$keep" ] || continue
+        [ -z "$max_age" ] || [ $(($now - ${release%%-*})) -ge "$max_age" ] || continue
+        rm -rf "$path"
+        echo "$path"
+    done
+    for manifest in "$home/.beach/releases" "$home/.beach/install-cache"; do
+        [ -f "$manifest" ] || continue
+        while read -r key path; do
+            if [ -d "$path" ]; then echo "$key $path"; fi
+        done < "$manifest" > "$manifest.tmp"
+        mv "$manifest.tmp" "$manifest"
+    done
+    # Staging directories and stored objects might belong to a deploy
+    # that's still in progress, so only old ones are removed. Uploads hold
+    # the lock on the store shared, so a store being uploaded to is skipped.
+    find "$home" -maxdepth 1 -name '.beach-staging-*' -mmin +60 -exec rm -rf {} +
+    if [ -d "$home/.beach/objects" ]; then
+        (
+            if flock -n 9; then
+                find "$home/.beach/objects" -maxdepth 1 -name '.partial-*' -mmin +60 -exec rm -rf {} +
+                find "$home/.beach/objects" -type f -links 1 -cmin +60 -exec rm -f {} +
+            fi
+        ) 9> "$home/.beach/objects.lock"
+    fi
+done
+"""
+
+
+# Install outputs are hardlinked from the cached release, so they share
+# inodes with it and should be replaced rather than modified in place.
+# Outputs that refer to the cached release by its absolute path, such as
+# virtualenvs, would break once it is removed, so they are not restored.
+_restore_install_cache_script = """set -e
+source="$1"
+destination="$2"
+shift 2
+for output_path in "$@"; do
+    [ -e "$source/$output_path" ] || exit 1
+    if grep -rqF "$source" "$source/$output_path"; then
+        exit 1
+    fi
+    if [ -n "$(find "$source/$output_path" -lname "$source*" | head -n 1)" ]; then
+        exit 1
+    fi
+done
+for output_path in "$@"; do
+    rm -rf "$destination/$output_path"
+    mkdir -p "$(dirname "$destination/$output_path")"
+    cp -al "$source/$output_path" "$destination/$output_path"
+done
+"""
+
+
+def _release_key(snapshot, install_command):
     hasher = hashlib.sha1()
-    while True:
-        data = fileobj.read(8192)
-        if not data:
-            break
-        hasher.update(data)
+    hasher.update(snapshot.hash.encode("ascii"))
+    if install_command is not None:
+        hasher.update(b"\0")
+        hasher.update(install_command.encode("utf8"))
     return hasher.hexdigest()
@@ -0,0 +1,84 @@
+import sys
+import threading
+
+
+def map_bounded(func, items, max_workers):
+    """
+    Call func on each item using at most max_workers threads.
+    
+    Returns a list of results in the same order as items. Errors raised by
+    func are captured in the corresponding result rather than propagated.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    next_index = [0]
+    lock = threading.Lock()
+    
+    def work():
+        while True:
+            with lock:
+                index = next_index[0]
+                next_index[0] += 1
+            if index >= len(items):
+                return
+            results[index] = _call(func, items[index])
+    
+    threads = [
+        threading.Thread(target=work)
+        for _ in range(max(1, min(max_workers, len(items))))
+    ]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def start(func, *args):
+    """
+    Call func with args on a new thread, so that it overlaps with whatever
+    the caller does next. Returns a task whose get() waits for func to
+    return, and then returns its value or raises its error.
+    
+    Callers should wait() for the task in a finally block, so that it never
+    outlives an error raised while it runs.
+    """
+    return _Task(func, args)
+
+
+class _Task(object):
+    def __init__(self, func, args):
+        self._result = None
+        self._thread = threading.Thread(target=self._run, args=(func, args))
+        self._thread.daemon = True
+        self._thread.start()
+    
+    def _run(self, func, args):
+        self._result = _call(lambda args: func(*args), args)
+    
+    def wait(self):
+        self._thread.join()
+    
+    def get(self):
+        self.wait()
+        return self._result.get()
+
+
+def _call(func, item):
+    try:
+        return Result(value=func(item))
+    except Exception:
+        return Result(error=sys.exc_info()[1])
+
+
+class Result(object):
+    def __init__(self, value=None, error=None):
+        self.value = value
+        self.error = error
+    
+    def get(self):
+        if self.error is None:
+            return self.value
+        else:
+            raise self.error
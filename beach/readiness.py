@@ -0,0 +1,78 @@
+import pipes
+
+from . import apps
+
+
+def read_probe(config, env):
+    probe_type = config.get("type")
+    timeout = config.get("timeout", 30)
+    if probe_type == "tcp":
+        port = apps.render(str(config["port"]), env)
+        return Probe(["sh", "-c", _tcp_probe_script, "sh", "{0:04X}".format(int(port))], timeout=timeout)
+    elif probe_type == "http":
+        url = apps.render(config["url"], env)
+        return Probe(["sh", "-c", _http_probe_script, "sh", url], timeout=timeout)
+    elif probe_type == "command":
+        command = apps.render(config["command"], env, quote=pipes.quote)
+        return Probe(["sh", "-c", command], timeout=timeout)
+    else:
+        raise ValueError("Unrecognised readiness probe type: {0}".format(probe_type))
+
+
+class Probe(object):
+    def __init__(self, command, timeout):
+        self.command = command
+        self.timeout = timeout
+
+
+def wait_until_ready(run, service_name, probe, cwd):
+    """
+    Wait until the probe passes on the target, or until its timeout.
+    
+    The probe is retried with backoff by a single script on the target, so
+    waiting costs one round trip however many attempts it takes.
+    """
+    import spur
+    
+    try:
+        run(["sh", "-c", _wait_script, "sh", str(probe.timeout)] + probe.command, cwd=cwd)
+    except spur.RunProcessError:
+        raise NotReadyError(service_name, probe.timeout)
+
+
+class NotReadyError(Exception):
+    def __init__(self, service_name, timeout):
+        super(NotReadyError, self).__init__(
+            "Service was not ready after {0}s: {1}".format(timeout, service_name))
+        self.service_name = service_name
+
+
+_wait_script = """
+deadline=$(($(date +%s) + $1))
+shift
+delay=10
+until "$@" > /dev/null 2>&1; do
+    if [ "$(date +%s)" -ge "$deadline" ]; then
+        exit 1
+    fi
+    sleep "$(($delay / 1000)).$(printf %03d $(($delay % 1000)))"
+    delay=$(($delay * 2))
+    if [ "$delay" -gt 1000 ]; then
+        delay=1000
+    fi
+done
+"""
+
+# Checks for a listening socket rather than connecting so that no tools
+# beyond a shell are needed on the target
+_tcp_probe_script = """
+grep -q ":$1 [0-9A-F]*:[0-9A-F]* 0A " /proc/net/tcp /proc/net/tcp6 2> /dev/null
+"""
+
+_http_probe_script = """
+if command -v curl > /dev/null; then
+    curl --fail --silent --output /dev/null "$1"
+else
+    wget --quiet --output-document /dev/null "$1"
+fi
+"""
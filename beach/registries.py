@@ -1,19 +1,38 @@
 import json
 import errno
+import sqlite3
+import threading
+
+try:
+    from urllib.parse import urlparse, urlencode, quote
+except ImportError:
+    from urlparse import urlparse
+    from urllib import urlencode, quote
+
+from . import tracing
 
 
 class InMemoryRegistry(object):
     def __init__(self):
         self._services = {}
+        self._version = 0
     
     def register(self, name, provides):
         self._services[name] = Service(provides)
+        self._version += 1
     
     def deregister(self, name):
         del self._services[name]
+        self._version += 1
+    
+    def version(self):
+        return self._version
     
     def find_service(self, name):
         return self._services.get(name)
+    
+    def find_services(self, names):
+        return dict((name, self.find_service(name)) for name in names)
 
 
 class FileRegistry(object):
@@ -38,11 +57,23 @@ class FileRegistry(object):
         self._write_registry(registry_json)
     
     def find_service(self, name):
-        service_json = self._read_registry().get(name)
-        if service_json is None:
-            return None
+        return _read_service(self._read_registry().get(name))
+    
+    def version(self):
+        # Cheaper than reading the file, and changes whenever it's rewritten
+        result = self._shell.run(["stat", "-c", "%y %s %i", self._path], allow_error=True)
+        if result.return_code == 0:
+            return result.output.strip().decode("utf8")
         else:
-            return _read_service(service_json)
+            return None
+    
+    def find_services(self, names):
+        with tracing.span("read registry"):
+            registry_json = self._read_registry()
+        return dict(
+            (name, _read_service(registry_json.get(name)))
+            for name in names
+        )
             
     def _write_registry(self, registry_json):
         with self._shell.open(self._path, "w") as registry_file:
@@ -63,8 +94,277 @@ class FileRegistry(object):
         return fileobj.read().strip() == ""
 
 
+class SqliteRegistry(object):
+    """
+    A registry stored in a local SQLite database.
+    
+    Services are indexed by name, so lookups don't depend on the size of the
+    registry, and each update is a transaction, so concurrent writers (in
+    different threads or processes) don't lose each other's updates. Each
+    update also increments a version stored alongside the services, so
+    versions read by any thread or process can be compared.
+    """
+    
+    def __init__(self, path, timeout=30):
+        self._path = path
+        self._timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+    
+    def register(self, name, provides):
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO services (name, provides) VALUES (?, ?)",
+                (name, json.dumps(provides)),
+            )
+            _increment_version(connection)
+    
+    def deregister(self, name):
+        with self._connection() as connection:
+            cursor = connection.execute("DELETE FROM services WHERE name = ?", (name,))
+            if cursor.rowcount == 0:
+                raise KeyError(name)
+            _increment_version(connection)
+    
+    def version(self):
+        version, = self._connection().execute("SELECT value FROM version").fetchone()
+        return version
+    
+    def find_service(self, name):
+        return self.find_services([name])[name]
+    
+    def find_services(self, names):
+        with tracing.span("read registry"):
+            return self._find_services(list(names))
+    
+    def _find_services(self, names):
+        services = dict((name, None) for name in names)
+        connection = self._connection()
+        for index in range(0, len(names), _sqlite_max_variables):
+            batch = names[index:index + _sqlite_max_variables]
+            rows = connection.execute(
+                "SELECT name, provides FROM services WHERE name IN ({0})".format(
+                    ", ".join("?" for name in batch)
+                ),
+                batch,
+            )
+            for name, provides in rows:
+                services[name] = Service(provides=json.loads(provides))
+        return services
+    
+    def close(self):
+        """
+        Close the connections of every thread that has used this registry.
+        """
+        with self._connections_lock:
+            connections = self._connections
+            self._connections = []
+            self._local = threading.local()
+        for connection in connections:
+            connection.close()
+    
+    def _connection(self):
+        local = self._local
+        connection = getattr(local, "connection", None)
+        if connection is None:
+            # Each connection is only used by its own thread, but may be
+            # closed by another
+            connection = sqlite3.connect(self._path, timeout=self._timeout, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS services "
+                    "(name TEXT PRIMARY KEY, provides TEXT NOT NULL)"
+                )
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS version "
+                    "(id INTEGER PRIMARY KEY CHECK (id = 0), value INTEGER NOT NULL)"
+                )
+                connection.execute("INSERT OR IGNORE INTO version (id, value) VALUES (0, 0)")
+            with self._connections_lock:
+                self._connections.append(connection)
+            local.connection = connection
+        return connection
+
+
+def _increment_version(connection):
+    connection.execute("UPDATE version SET value = value + 1")
+
+
+_sqlite_max_variables = 999
+
+
+class HttpRegistry(object):
+    """
+    A client for a registry served by beach.registry_server.
+    
+    Each thread keeps its own connection to the server open between
+    requests.
+    """
+    
+    def __init__(self, url, timeout=30):
+        parsed_url = urlparse(url)
+        self._host = parsed_url.hostname
+        self._port = parsed_url.port
+        self._prefix = parsed_url.path.rstrip("/")
+        self._timeout = timeout
+        self._local = threading.local()
+        # Imported here rather than for every registry since the HTTP
+        # client is slow to import
+        self._http = _http_client()
+    
+    def register(self, name, provides):
+        self._request("PUT", "/services/" + quote(name, safe=""), {"provides": provides})
+    
+    def deregister(self, name):
+        status, body = self._request("DELETE", "/services/" + quote(name, safe=""), allow_not_found=True)
+        if status == 404:
+            raise KeyError(name)
+    
+    def find_service(self, name):
+        return self.find_services([name])[name]
+    
+    def find_services(self, names):
+        names = list(names)
+        with tracing.span("read registry"):
+            status, body = self._request("GET", "/services?" + urlencode([("name", name) for name in names]))
+        return dict(
+            (name, _read_service(body["services"].get(name)))
+            for name in names
+        )
+    
+    def version(self):
+        status, body = self._request("GET", "/version")
+        return body["version"]
+    
+    def watch(self, version, timeout=30):
+        """
+        Wait until the registry's version is no longer version, or until the
+        timeout. Returns the registry's version.
+        """
+        query = urlencode([("version", version), ("timeout", timeout)])
+        status, body = self._request("GET", "/watch?" + query, timeout=self._timeout + timeout)
+        return body["version"]
+    
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+    
+    def _request(self, method, path, value=None, allow_not_found=False, timeout=None):
+        body = None if value is None else json.dumps(value).encode("utf8")
+        headers = {"Content-Type": "application/json"}
+        try:
+            response = self._send(method, path, body, headers, timeout)
+        except (IOError, OSError, self._http.HTTPException):
+            # The server may have closed an idle connection, so retry once on
+            # a new connection
+            self.close()
+            response = self._send(method, path, body, headers, timeout)
+        
+        response_body = json.loads(response.read().decode("utf8"))
+        if response.status == 200 or (allow_not_found and response.status == 404):
+            return response.status, response_body
+        else:
+            raise IOError("Registry request failed with status {0}: {1} {2}".format(response.status, method, path))
+    
+    def _send(self, method, path, body, headers, timeout):
+        connection = self._connection()
+        connection.timeout = timeout or self._timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(connection.timeout)
+        connection.request(method, self._prefix + path, body, headers)
+        return connection.getresponse()
+    
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._http.HTTPConnection(self._host, self._port, timeout=self._timeout)
+            self._local.connection = connection
+        return connection
+
+
+def _http_client():
+    try:
+        import http.client
+        return http.client
+    except ImportError:
+        import httplib
+        return httplib
+
+
+class CachingRegistry(object):
+    """
+    Caches the services found in another registry.
+    
+    Before each lookup, the cache is checked against the version of the
+    underlying registry, which is much cheaper than reading the registry,
+    and is cleared if the registry has changed. Writes through the cache
+    also clear it.
+    """
+    
+    def __init__(self, registry):
+        self._registry = registry
+        self._lock = threading.Lock()
+        self._services = {}
+        self._version = None
+    
+    def register(self, name, provides):
+        self._registry.register(name, provides)
+        self.invalidate()
+    
+    def deregister(self, name):
+        self._registry.deregister(name)
+        self.invalidate()
+    
+    def find_service(self, name):
+        return self.find_services([name])[name]
+    
+    def find_services(self, names):
+        names = list(names)
+        version = self._registry.version()
+        with self._lock:
+            if version is None or version != self._version:
+                self._services = {}
+                self._version = version
+            services = dict(
+                (name, self._services[name])
+                for name in names
+                if name in self._services
+            )
+        
+        missing_names = [name for name in names if name not in services]
+        if missing_names:
+            found_services = self._registry.find_services(missing_names)
+            services.update(found_services)
+            with self._lock:
+                # If the registry changed while we were reading it, the
+                # next lookup will see a new version and clear the cache
+                if self._version == version and version is not None:
+                    self._services.update(found_services)
+        return services
+    
+    def version(self):
+        return self._registry.version()
+    
+    def invalidate(self):
+        with self._lock:
+            self._services = {}
+            self._version = None
+    
+    def close(self):
+        close = getattr(self._registry, "close", None)
+        if close is not None:
+            close()
+
+
 def _read_service(service_json):
-    return Service(provides=service_json["provides"])
+    if service_json is None:
+        return None
+    else:
+        return Service(provides=service_json["provides"])
 
 
 class Service(object):
@@ -0,0 +1,186 @@
+import json
+import os
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs, unquote
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+    from urllib import unquote
+
+
+class RegistryServer(object):
+    """
+    Serves a registry over HTTP.
+    
+    Services are held in memory and, if a path is given, written to that
+    file after every change. The API is:
+        
+        GET /services?name=a&name=b   find many services at once
+        PUT /services/<name>          register, with {"provides": {...}}
+        DELETE /services/<name>       deregister
+        GET /version                  the current version
+        GET /watch?version=<v>        wait until the version isn't v
+    """
+    
+    def __init__(self, host="127.0.0.1", port=0, path=None):
+        self._store = _Store(path)
+        self._server = _ThreadingHTTPServer((host, port), _handler(self._store))
+        self._thread = None
+    
+    @property
+    def address(self):
+        return self._server.server_address
+    
+    @property
+    def url(self):
+        return "http://{0}:{1}".format(*self.address)
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+    
+    def serve_forever(self):
+        self._server.serve_forever()
+    
+    def close(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+        self._server.server_close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Store(object):
+    def __init__(self, path):
+        self._path = path
+        self._condition = threading.Condition()
+        self._services = {}
+        self.version = 0
+        if path is not None and os.path.exists(path):
+            with open(path) as store_file:
+                stored = json.load(store_file)
+            self._services = stored["services"]
+            self.version = stored["version"]
+    
+    def find_services(self, names):
+        with self._condition:
+            services = dict((name, self._services.get(name)) for name in names)
+            return self.version, services
+    
+    def register(self, name, provides):
+        with self._condition:
+            self._services[name] = {"provides": provides}
+            self._changed()
+    
+    def deregister(self, name):
+        with self._condition:
+            if name not in self._services:
+                return False
+            del self._services[name]
+            self._changed()
+            return True
+    
+    def wait_for_change(self, version, timeout):
+        deadline = time.time() + timeout
+        with self._condition:
+            while self.version == version:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return self.version
+    
+    def _changed(self):
+        self.version += 1
+        if self._path is not None:
+            temp_path = self._path + ".tmp"
+            with open(temp_path, "w") as store_file:
+                json.dump({"version": self.version, "services": self._services}, store_file)
+            os.rename(temp_path, self._path)
+        self._condition.notify_all()
+
+
+_max_watch_timeout = 60
+
+
+def _handler(store):
+    class Handler(_RegistryRequestHandler):
+        pass
+    Handler.store = store
+    return Handler
+
+
+class _RegistryRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/services":
+            version, services = self.store.find_services(query.get("name", []))
+            self._send_json(200, {"version": version, "services": services})
+        elif url.path == "/version":
+            self._send_json(200, {"version": self.store.version})
+        elif url.path == "/watch":
+            version = int(query["version"][0])
+            timeout = min(float(query.get("timeout", [_max_watch_timeout])[0]), _max_watch_timeout)
+            self._send_json(200, {"version": self.store.wait_for_change(version, timeout)})
+        else:
+            self._send_json(404, {"error": "Not found"})
+    
+    def do_PUT(self):
+        name = self._service_name()
+        if name is None:
+            self._send_json(404, {"error": "Not found"})
+        else:
+            body = json.loads(self._read_body().decode("utf8"))
+            self.store.register(name, body["provides"])
+            self._send_json(200, {})
+    
+    def do_DELETE(self):
+        name = self._service_name()
+        if name is None or not self.store.deregister(name):
+            self._send_json(404, {"error": "Not found"})
+        else:
+            self._send_json(200, {})
+    
+    def log_message(self, *args):
+        pass
+    
+    def _service_name(self):
+        prefix = "/services/"
+        path = urlparse(self.path).path
+        if path.startswith(prefix) and len(path) > len(prefix):
+            return unquote(path[len(prefix):])
+        else:
+            return None
+    
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length)
+    
+    def _send_json(self, status, value):
+        body = json.dumps(value).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
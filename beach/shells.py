@@ -0,0 +1,126 @@
+import threading
+
+from . import contexts, tracing
+
+
+def create_shell(target):
+    protocol = target.get("protocol")
+    if protocol is None:
+        return LocalShell()
+    elif protocol == "ssh":
+        # spur imports paramiko, which is most of the CLI's startup time, so
+        # it's only imported for commands that need a remote shell
+        import spur
+        
+        # TODO: shouldn't blindly accept a missing host key.
+        return spur.SshShell(
+            hostname=target["hostname"],
+            port=target.get("port", 22),
+            username=target.get("username"),
+            password=target.get("password"),
+            missing_host_key=spur.ssh.MissingHostKey.accept,
+        )
+    else:
+        raise ValueError("Unrecognised protocol: {0}".format(protocol))
+
+
+class LocalShell(contexts.Closeable):
+    """
+    A shell on the local machine that opens files itself, and only creates a
+    spur.LocalShell when a command is run. Commands that only read and write
+    local files, such as registering with a local FileRegistry, therefore
+    never import spur.
+    """
+    
+    def __init__(self):
+        self._shell = None
+        self._lock = threading.Lock()
+    
+    def __getattr__(self, name):
+        return getattr(self._spur_shell(), name)
+    
+    def open(self, name, mode="r"):
+        return open(name, mode)
+    
+    def close(self):
+        if self._shell is not None:
+            self._shell.close()
+    
+    def _spur_shell(self):
+        with self._lock:
+            if self._shell is None:
+                import spur
+                self._shell = spur.LocalShell()
+            return self._shell
+
+
+class ShellPool(contexts.Closeable):
+    """
+    Hands out one shell per target, so that everything talking to the same
+    host shares a single connection. Closing the pool closes every shell it
+    created.
+    """
+    
+    def __init__(self):
+        self._shells = {}
+        self._lock = threading.Lock()
+    
+    def shell(self, target):
+        key = _target_key(target)
+        with self._lock:
+            shell = self._shells.get(key)
+            if shell is None:
+                shell = self._shells[key] = tracing.TracingShell(_SerialFirstUse(create_shell(target)))
+            return shell
+    
+    def close(self):
+        with self._lock:
+            shells = list(self._shells.values())
+            self._shells = {}
+        for shell in shells:
+            shell.close()
+
+
+class _SerialFirstUse(object):
+    """
+    Wraps a shell so that its first command, or first file opened, is run
+    by one thread at a time. Shells such as spur.SshShell connect on first
+    use without a lock, so threads that started using a new shell at the
+    same time would each open a connection, of which only the last would
+    ever be closed.
+    """
+    
+    def __init__(self, shell):
+        self._shell = shell
+        self._lock = threading.Lock()
+        self._used = False
+    
+    def __getattr__(self, name):
+        return getattr(self._shell, name)
+    
+    def run(self, *args, **kwargs):
+        return self._use(self._shell.run, args, kwargs)
+    
+    def spawn(self, *args, **kwargs):
+        return self._use(self._shell.spawn, args, kwargs)
+    
+    def open(self, *args, **kwargs):
+        return self._use(self._shell.open, args, kwargs)
+    
+    def close(self):
+        self._shell.close()
+    
+    def _use(self, func, args, kwargs):
+        if self._used:
+            return func(*args, **kwargs)
+        with self._lock:
+            result = func(*args, **kwargs)
+            self._used = True
+            return result
+
+
+def _target_key(target):
+    return tuple(
+        target.get(key)
+        for key in ["protocol", "hostname", "port", "username", "password"]
+    )
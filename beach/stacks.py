@@ -0,0 +1,116 @@
+import sys
+import threading
+import time
+
+from . import apps
+
+
+def deploy(deployer, paths, params, max_workers):
+    """
+    Deploy many apps, each once the apps in the stack that it depends on
+    have been deployed and registered what they provide.
+    
+    Apps with no dependencies between them are deployed concurrently, using
+    at most max_workers threads. Dependencies that aren't in the stack are
+    expected to be in the registry already. If an app fails to deploy, the
+    apps that depend on it are skipped.
+    """
+    stack_apps = _read_stack(paths)
+    results = {}
+    pending = list(stack_apps)
+    running = [0]
+    condition = threading.Condition()
+    
+    def deploy_app(app):
+        start_time = time.time()
+        try:
+            deployer.deploy(app.path, params=params)
+            result = AppResult(app.name, seconds=time.time() - start_time)
+        except Exception:
+            result = AppResult(app.name, error=sys.exc_info()[1])
+        
+        with condition:
+            results[app.name] = result
+            running[0] -= 1
+            condition.notify_all()
+    
+    with condition:
+        while len(results) < len(stack_apps):
+            progressed = False
+            for app in list(pending):
+                dependency_results = [results.get(name) for name in app.dependencies]
+                failed_dependencies = [
+                    name
+                    for name, result in zip(app.dependencies, dependency_results)
+                    if result is not None and not result.succeeded
+                ]
+                if failed_dependencies:
+                    pending.remove(app)
+                    results[app.name] = AppResult(app.name, error=DependencyFailedError(failed_dependencies[0]))
+                    progressed = True
+                elif None not in dependency_results and running[0] < max_workers:
+                    pending.remove(app)
+                    running[0] += 1
+                    thread = threading.Thread(target=deploy_app, args=(app, ))
+                    thread.daemon = True
+                    thread.start()
+            
+            if not progressed and len(results) < len(stack_apps):
+                condition.wait()
+    
+    return [results[app.name] for app in stack_apps]
+
+
+class AppResult(object):
+    def __init__(self, name, seconds=None, error=None):
+        self.name = name
+        self.seconds = seconds
+        self.error = error
+    
+    @property
+    def succeeded(self):
+        return self.error is None
+
+
+class DependencyFailedError(Exception):
+    def __init__(self, dependency_name):
+        super(DependencyFailedError, self).__init__(
+            "Dependency failed to deploy: {0}".format(dependency_name))
+        self.dependency_name = dependency_name
+
+
+def _read_stack(paths):
+    stack_apps = []
+    for path in paths:
+        app_config = apps.read_app_config(path)
+        stack_apps.append(_StackApp(path, app_config["name"], app_config.get("dependencies", [])))
+    
+    names = [app.name for app in stack_apps]
+    for name in names:
+        if names.count(name) > 1:
+            raise ValueError("App appears more than once in stack: {0}".format(name))
+    
+    for app in stack_apps:
+        app.dependencies = [name for name in app.dependencies if name in names]
+    
+    _check_for_cycles(stack_apps)
+    return stack_apps
+
+
+def _check_for_cycles(stack_apps):
+    remaining = dict((app.name, set(app.dependencies)) for app in stack_apps)
+    while remaining:
+        ready = [name for name, dependencies in remaining.items() if not dependencies]
+        if not ready:
+            raise ValueError("Dependency cycle between: {0}".format(", ".join(sorted(remaining))))
+        for name in ready:
+            del remaining[name]
+        for dependencies in remaining.values():
+            dependencies.difference_update(ready)
+
+
+class _StackApp(object):
+    def __init__(self, path, name, dependencies):
+        self.path = path
+        self.name = name
+        self.dependencies = dependencies
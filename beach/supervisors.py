@@ -1,10 +1,13 @@
+import errno
 import os
 import pipes
 import signal
+import socket
+import subprocess
+import threading
+import time
 
-import spur
-
-from . import contexts
+from . import contexts, tracing
 
 
 def runit(shell):
@@ -16,71 +19,492 @@ def stop_on_exit():
 
 
 class StopOnExit(contexts.Closeable):
-    def __init__(self):
+    """
+    Runs each service as a single process on the local machine, stopping
+    them when closed.
+    
+    Services that exit are restarted after a delay that doubles with each
+    consecutive crash, from min_restart_delay up to max_restart_delay. An
+    exit with status 0 counts as a crash, since services are expected to
+    keep running until stopped, as does failing to start the process.
+    """
+    
+    def __init__(self, min_restart_delay=0.1, max_restart_delay=30):
+        self._restart_delays = (min_restart_delay, max_restart_delay)
         self._processes = {}
+        self._lock = threading.Lock()
     
     def close(self):
-        for process in self._processes.values():
-            self._kill(process)
+        with self._lock:
+            for process, command in self._processes.values():
+                process.stop()
+            self._processes = {}
     
     def install(self):
         pass
     
-    def set_up(self, service_name, cwd, username, command):
+    def set_up(self, service_name, cwd, username, command, reload_signal=None, listen_port=None):
         if username is None:
-            existing_process = self._processes.get(service_name)
-            if existing_process is not None:
-                self._kill(existing_process)
-            
-            shell = spur.LocalShell()
-            process = shell.spawn(
-                ["sh", "-c", "exec {0}".format(command)],
-                allow_error=True,
-                cwd=cwd,
-            )
-            self._processes[service_name] = process
+            with self._lock:
+                existing = self._processes.get(service_name)
+                if existing is not None:
+                    existing_process, existing_command = existing
+                    if reload_signal is not None and existing_command == (cwd, command) and existing_process.is_running():
+                        existing_process.send_signal(_signal_number(reload_signal))
+                        return
+                    existing_process.stop()
+                
+                process = _MonitoredProcess(
+                    lambda: _spawn(cwd, command),
+                    *self._restart_delays
+                )
+                self._processes[service_name] = (process, (cwd, command))
         else:
             raise ValueError("username must be None")
     
-    def _kill(self, process):
-        process.send_signal(signal.SIGTERM)
-        process.wait_for_result()
+    def set_up_many(self, services):
+        for service in services:
+            self.set_up(**service)
+    
+    def stats(self):
+        """
+        Returns a dict from service name to a list of ProcessStats, one for
+        the process of that service.
+        """
+        with self._lock:
+            return dict(
+                (service_name, [process.stats()])
+                for service_name, (process, command) in self._processes.items()
+            )
+
+
+def prefork(workers, min_restart_delay=0.1, max_restart_delay=30):
+    return Prefork(workers, min_restart_delay=min_restart_delay, max_restart_delay=max_restart_delay)
+
+
+class Prefork(contexts.Closeable):
+    """
+    Runs each service as a pool of worker processes on the local machine,
+    stopping them when closed.
+    
+    If a service has a listen_port, the supervisor binds the socket once and
+    passes it to every worker as file descriptor 3, following the
+    LISTEN_FDS convention used by systemd. Workers are replaced one at a
+    time, each new worker starting before the old one is stopped, so the
+    port keeps accepting connections throughout a restart. A service
+    without a listen_port binds its own port, so runs as a single worker.
+    
+    Workers that exit are restarted with backoff, as with StopOnExit.
+    """
+    
+    def __init__(self, workers, min_restart_delay=0.1, max_restart_delay=30):
+        self._workers = workers
+        self._restart_delays = (min_restart_delay, max_restart_delay)
+        self._pools = {}
+        self._lock = threading.Lock()
+    
+    def close(self):
+        with self._lock:
+            for pool in self._pools.values():
+                pool.stop()
+            self._pools = {}
+    
+    def install(self):
+        pass
+    
+    def set_up(self, service_name, cwd, username, command, reload_signal=None, listen_port=None):
+        if username is not None:
+            raise ValueError("username must be None")
+        
+        with self._lock:
+            pool = self._pools.get(service_name)
+            if pool is not None and pool.listen_port == listen_port:
+                if reload_signal is not None and pool.command == (cwd, command) and pool.is_running():
+                    pool.send_signal(_signal_number(reload_signal))
+                else:
+                    pool.replace_workers(cwd, command)
+            else:
+                if pool is not None:
+                    pool.stop()
+                self._pools[service_name] = _WorkerPool(
+                    self._workers,
+                    listen_port,
+                    cwd,
+                    command,
+                    self._restart_delays,
+                )
+    
+    def set_up_many(self, services):
+        for service in services:
+            self.set_up(**service)
+    
+    def stats(self):
+        """
+        Returns a dict from service name to a list of ProcessStats, one for
+        each worker of that service.
+        """
+        with self._lock:
+            return dict(
+                (service_name, pool.stats())
+                for service_name, pool in self._pools.items()
+            )
+
+
+class ProcessStats(object):
+    """
+    pid is None while the process is waiting to be restarted, in which case
+    uptime_seconds, cpu_seconds and rss_bytes are zero. restarts and
+    peak_rss_bytes cover every run of the process since it was set up.
+    """
+    
+    def __init__(self, pid, restarts, uptime_seconds, cpu_seconds, rss_bytes, peak_rss_bytes):
+        self.pid = pid
+        self.restarts = restarts
+        self.uptime_seconds = uptime_seconds
+        self.cpu_seconds = cpu_seconds
+        self.rss_bytes = rss_bytes
+        self.peak_rss_bytes = peak_rss_bytes
+
+
+class _WorkerPool(object):
+    def __init__(self, workers, listen_port, cwd, command, restart_delays):
+        self.listen_port = listen_port
+        if listen_port is None:
+            self._socket = None
+            workers = 1
+        else:
+            self._socket = _listen(listen_port)
+        self.command = (cwd, command)
+        self._restart_delays = restart_delays
+        self._processes = [self._start_worker() for _ in range(workers)]
+    
+    def replace_workers(self, cwd, command):
+        self.command = (cwd, command)
+        for index, process in enumerate(self._processes):
+            if self._socket is None:
+                process.stop()
+                self._processes[index] = self._start_worker()
+            else:
+                self._processes[index] = self._start_worker()
+                process.stop()
+    
+    def is_running(self):
+        return all(process.is_running() for process in self._processes)
+    
+    def send_signal(self, signal_number):
+        for process in self._processes:
+            process.send_signal(signal_number)
+    
+    def stats(self):
+        return [process.stats() for process in self._processes]
+    
+    def stop(self):
+        for process in self._processes:
+            process.stop()
+        if self._socket is not None:
+            self._socket.close()
+    
+    def _start_worker(self):
+        cwd, command = self.command
+        return _MonitoredProcess(
+            lambda: _spawn(cwd, command, listen_socket=self._socket),
+            *self._restart_delays
+        )
+
+
+class _MonitoredProcess(object):
+    """
+    Runs the process returned by spawn until stopped, restarting it with
+    backoff whenever it exits, whatever its status, or fails to start.
+    
+    A thread per process blocks in wait4(), so exits are noticed without
+    polling, and the peak memory of each run is read from its rusage.
+    """
+    
+    def __init__(self, spawn, min_restart_delay, max_restart_delay):
+        self._spawn = spawn
+        self._min_restart_delay = min_restart_delay
+        self._max_restart_delay = max_restart_delay
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._restarts = 0
+        self._peak_rss_bytes = 0
+        self._start()
+        self._thread = threading.Thread(target=self._monitor)
+        self._thread.daemon = True
+        self._thread.start()
+    
+    def is_running(self):
+        with self._condition:
+            return self._process is not None
+    
+    def send_signal(self, signal_number):
+        with self._condition:
+            if self._process is not None:
+                _send_signal(self._process, signal_number)
+    
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+            if self._process is not None:
+                _send_signal(self._process, signal.SIGTERM)
+        self._thread.join()
+    
+    def stats(self):
+        with self._condition:
+            process = self._process
+            if process is None:
+                return ProcessStats(
+                    pid=None,
+                    restarts=self._restarts,
+                    uptime_seconds=0,
+                    cpu_seconds=0,
+                    rss_bytes=0,
+                    peak_rss_bytes=self._peak_rss_bytes,
+                )
+            
+            cpu_seconds, rss_bytes, peak_rss_bytes = _read_process_usage(process.pid)
+            self._peak_rss_bytes = max(self._peak_rss_bytes, peak_rss_bytes)
+            return ProcessStats(
+                pid=process.pid,
+                restarts=self._restarts,
+                uptime_seconds=time.time() - self._start_time,
+                cpu_seconds=cpu_seconds,
+                rss_bytes=rss_bytes,
+                peak_rss_bytes=self._peak_rss_bytes,
+            )
+    
+    def _start(self):
+        self._process = self._spawn()
+        self._start_time = time.time()
+    
+    def _monitor(self):
+        consecutive_crashes = 0
+        while True:
+            if self._process is not None:
+                status, usage = _wait4(self._process.pid)
+                with self._condition:
+                    self._process.returncode = _return_code(status)
+                    self._process = None
+                    # ru_maxrss is in kilobytes on Linux
+                    self._peak_rss_bytes = max(self._peak_rss_bytes, usage.ru_maxrss * 1024)
+            
+            with self._condition:
+                if time.time() - self._start_time >= self._max_restart_delay:
+                    consecutive_crashes = 0
+                delay = min(self._min_restart_delay * 2 ** consecutive_crashes, self._max_restart_delay)
+                consecutive_crashes += 1
+                
+                deadline = time.time() + delay
+                while not self._stopping and time.time() < deadline:
+                    self._condition.wait(deadline - time.time())
+                if self._stopping:
+                    return
+                try:
+                    self._start()
+                except Exception:
+                    # Such as the working directory having been removed,
+                    # which is backed off from in the same way as a crash
+                    self._process = None
+                    self._start_time = time.time()
+                self._restarts += 1
+
+
+def _send_signal(process, signal_number):
+    # Popen.send_signal can reap the process itself, on Python 3.9 and later,
+    # which would leave the monitor waiting on a pid that no longer exists
+    try:
+        os.kill(process.pid, signal_number)
+    except OSError as error:
+        # The process may have exited but not yet been seen to by the monitor
+        if error.errno != errno.ESRCH:
+            raise
+
+
+def _wait4(pid):
+    while True:
+        try:
+            waited_pid, status, usage = os.wait4(pid, 0)
+            return status, usage
+        except OSError as error:
+            if error.errno != errno.EINTR:
+                raise
+
+
+def _return_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    else:
+        return os.WEXITSTATUS(status)
+
+
+_listen_fd = 3
+
+
+def _spawn(cwd, command, listen_socket=None):
+    env = os.environ.copy()
+    script = "exec {0}".format(command)
+    
+    with open(os.devnull, "r+") as devnull:
+        stdin = devnull
+        if listen_socket is not None:
+            # The listening socket is passed as stdin, which survives
+            # close_fds, and the script moves it into place. Nothing needs to
+            # run between fork and exec, and sh can only redirect descriptors
+            # 0 to 9, so the socket's own descriptor couldn't be passed.
+            env["LISTEN_FDS"] = "1"
+            script = "export LISTEN_PID=$$\nexec {0}<&0 </dev/null\n".format(_listen_fd) + script
+            stdin = listen_socket
+        return subprocess.Popen(
+            ["sh", "-c", script],
+            cwd=cwd,
+            env=env,
+            stdin=stdin,
+            stdout=devnull,
+            stderr=devnull,
+            close_fds=True,
+        )
+
+
+def _listen(port):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("", port))
+    listener.listen(128)
+    return listener
+
+
+def _read_process_usage(pid):
+    # Returns the CPU seconds, resident bytes and peak resident bytes of pid
+    try:
+        with open("/proc/{0}/stat".format(pid)) as stat_file:
+            stat = stat_file.read()
+        with open("/proc/{0}/status".format(pid)) as status_file:
+            status_lines = status_file.read().splitlines()
+    except IOError:
+        return 0, 0, 0
+    
+    # The command name may contain spaces, so fields are counted from the
+    # end of the name. See proc(5) for the layout.
+    fields = stat[stat.rindex(")") + 2:].split()
+    cpu_ticks = int(fields[11]) + int(fields[12])
+    rss_bytes = int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+    
+    peak_rss_bytes = rss_bytes
+    for line in status_lines:
+        if line.startswith("VmHWM:"):
+            peak_rss_bytes = int(line.split()[1]) * 1024
+    
+    return cpu_ticks / float(os.sysconf("SC_CLK_TCK")), rss_bytes, peak_rss_bytes
 
 
 def _supervisor(shell, name):
-    path = os.path.join(os.path.dirname(__file__), "../shell/supervisors/", name)
-    return Supervisor(shell, path)
+    return Supervisor(shell, _supervisor_scripts_dir(name))
+
+
+def _supervisor_scripts_dir(name):
+    return os.path.join(os.path.dirname(__file__), "../shell/supervisors/", name)
 
 
 class Supervisor(contexts.Closeable):
     def __init__(self, shell, scripts_dir):
         self._shell = shell
-        self._scripts_dir = scripts_dir
+        self._scripts = _read_scripts(scripts_dir)
+        self._installed = False
+        self._install_lock = threading.Lock()
     
     def close(self):
         pass
     
     def install(self):
-        self._run_script("install")
+        # The install script also records on the host that it has been run,
+        # so only the first install per host does any work
+        with self._install_lock:
+            if not self._installed:
+                with tracing.span("install supervisor"):
+                    self._run_script("install")
+                self._installed = True
     
-    def set_up(self, service_name, cwd, username, command):
+    def set_up(self, service_name, cwd, username, command, reload_signal=None, listen_port=None):
+        self.set_up_many([{
+            "service_name": service_name,
+            "cwd": cwd,
+            "username": username,
+            "command": command,
+            "reload_signal": reload_signal,
+        }])
+    
+    def set_up_many(self, services):
+        """
+        Set up many services with a single remote script.
+        
+        Each service is a dict of the arguments to set_up. The services
+        are created, and restarted if already running, concurrently.
+        
+        If a service is already running with the same run file and has a
+        reload_signal, it's sent that signal instead of being restarted, so
+        that it can replace itself without dropping connections.
+        """
+        script = [
+            "create_service() {",
+            self._scripts["create-service"],
+            "}",
+            "pids=",
+        ]
+        for service in services:
+            script.append("service_name={0} command={1} reload_signal={2}".format(
+                pipes.quote(service["service_name"]),
+                pipes.quote(self._service_command(
+                    cwd=service["cwd"],
+                    username=service["username"],
+                    command=service["command"],
+                )),
+                pipes.quote(service.get("reload_signal") or ""),
+            ))
+            script.append('(create_service) & pids="$pids $!"')
+        script += [
+            "status=0",
+            'for pid in $pids; do wait "$pid" || status=1; done',
+            "exit $status",
+        ]
+        with tracing.span("create services", services=len(services)):
+            self._shell.run(["sh", "-c", "\n".join(script)])
+    
+    def _service_command(self, cwd, username, command):
         assert username is not None
         exec_command = "set -e\ncd {0}\nexec {1}".format(
             pipes.quote(cwd), command)
-        full_command = "set -e\nexec su {0} - -c sh -c {1}".format(
+        return "set -e\nexec su {0} - -c sh -c {1}".format(
             username, pipes.quote(exec_command))
-        self._run_script(
-            "create-service",
-            {"service_name": service_name, "command": full_command},
-        )
     
     def _run_script(self, name, env={}):
-        self._shell.run(["sh", "-c", self._read_script(name)], update_env=env)
-    
-    def _read_script(self, name):
-        return _read_file(os.path.join(self._scripts_dir, name))
-        
+        self._shell.run(["sh", "-c", self._scripts[name]], update_env=env)
+
+
+def _signal_number(name):
+    if not name.startswith("SIG"):
+        name = "SIG" + name
+    return getattr(signal, name)
+
+
+def _read_scripts(scripts_dir):
+    scripts_dir = os.path.normpath(scripts_dir)
+    scripts = _scripts.get(scripts_dir)
+    if scripts is None:
+        scripts = _scripts[scripts_dir] = dict(
+            (name, _read_file(os.path.join(scripts_dir, name)))
+            for name in os.listdir(scripts_dir)
+        )
+    return scripts
+
 
 def _read_file(path):
     with open(path) as f:
         return f.read()
+
+
+_scripts = {}
+
+if os.path.isdir(_supervisor_scripts_dir("runit")):
+    _read_scripts(_supervisor_scripts_dir("runit"))
@@ -1,47 +1,328 @@
 import contextlib
+import gzip
+import tarfile
 import tempfile
 import os
 import subprocess
+import sys
+import threading
 
-import mayo
+from . import tracing
 
 
 @contextlib.contextmanager
-def create_temp_tarball(path):
-    path = os.path.normpath(path)
+def create_temp_tarball(path, compression=None):
+    if compression is None:
+        compression = default_compression
     
     with tempfile.NamedTemporaryFile() as tarball:
-        filenames = [
-            os.path.join(os.path.basename(path), filename)
-            for filename in _filenames(path)
-        ]
-        subprocess.check_call(
-            ["tar", "czf", tarball.name] + filenames,
-            cwd=os.path.dirname(path),
-        )
+        with compression.compress(tarball) as compressed_tarball:
+            write_tarball(path, compressed_tarball)
+        tarball.flush()
+        tarball.seek(0)
         yield tarball
 
 
-def _filenames(path):
-    repository = mayo.repository_at(path)
-    if repository is not None and repository.type == "git":
-        return _git_filenames(repository)
+def read_compression(config):
+    if config is None:
+        return default_compression
     else:
-        return _all_filenames(path)
+        return Compression(
+            codec=config.get("codec", "gzip"),
+            level=config.get("level"),
+            threads=config.get("threads", 1),
+        )
+
+
+class Compression(object):
+    """
+    How archives are compressed: with gzip, zstd or not at all.
+    
+    gzip on a single thread runs in-process. Multi-threaded gzip uses pigz
+    and zstd uses the zstd command, both of which must be installed locally.
+    A threads value of 0 uses every core. tar_options are the options that
+    tar on the target needs to extract the archive.
+    """
+    
+    def __init__(self, codec="gzip", level=None, threads=1):
+        if codec not in _codecs:
+            raise ValueError("Unrecognised compression codec: {0}".format(codec))
+        self.codec = codec
+        self.level = level
+        self.threads = threads
+        self.tar_options = _codecs[codec]
+    
+    @contextlib.contextmanager
+    def compress(self, fileobj):
+        compressor = self._compressor(fileobj)
+        try:
+            yield compressor
+        except:
+            compressor.abort()
+            raise
+        compressor.close()
+    
+    def _compressor(self, fileobj):
+        threads = self.threads or _cpu_count()
+        gzip_level = 6 if self.level is None else self.level
+        zstd_level = 3 if self.level is None else self.level
+        if self.codec == "none":
+            return _UncompressedWriter(fileobj)
+        elif self.codec == "gzip" and threads == 1:
+            return _GzipWriter(fileobj, level=gzip_level)
+        elif self.codec == "gzip":
+            command = ["pigz", "-c", "-{0}".format(gzip_level), "-p", str(threads)]
+            return _ProcessWriter(command, fileobj)
+        else:
+            command = ["zstd", "-q", "-c", "-{0}".format(zstd_level), "-T{0}".format(threads)]
+            return _ProcessWriter(command, fileobj)
+
+
+_codecs = {
+    "none": [],
+    "gzip": ["-z"],
+    "zstd": ["--use-compress-program=zstd"],
+}
+
+default_compression = Compression()
+
+
+def _cpu_count():
+    # Only needed when compressing with several threads, so it isn't
+    # imported for commands that never upload
+    import multiprocessing
+    
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+class _UncompressedWriter(object):
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+    
+    def write(self, data):
+        self._fileobj.write(data)
+    
+    def close(self):
+        pass
+    
+    def abort(self):
+        pass
+
+
+class _GzipWriter(object):
+    def __init__(self, fileobj, level):
+        self._gzip_file = gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=level, mtime=0)
+    
+    def write(self, data):
+        self._gzip_file.write(data)
+    
+    def close(self):
+        self._gzip_file.close()
+    
+    def abort(self):
+        pass
+
+
+class _ProcessWriter(object):
+    """
+    Pipes data through a compression command, copying its output to
+    fileobj on a separate thread so that neither pipe can fill up.
+    """
+    
+    def __init__(self, command, fileobj):
+        self._command = command
+        self._fileobj = fileobj
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self._error = None
+        self._thread = threading.Thread(target=self._copy_output)
+        self._thread.daemon = True
+        self._thread.start()
+    
+    def write(self, data):
+        self._process.stdin.write(data)
+    
+    def close(self):
+        self._process.stdin.close()
+        self._thread.join()
+        return_code = self._process.wait()
+        if self._error is not None:
+            raise self._error
+        if return_code != 0:
+            raise subprocess.CalledProcessError(return_code, self._command[0])
+    
+    def abort(self):
+        try:
+            self._process.stdin.close()
+        except IOError:
+            pass
+        self._thread.join()
+        self._process.wait()
+    
+    def _copy_output(self):
+        while True:
+            data = self._process.stdout.read(64 * 1024)
+            if not data:
+                return
+            if self._error is None:
+                try:
+                    self._fileobj.write(data)
+                except Exception as error:
+                    # Keep reading so that the compressor doesn't block
+                    self._error = error
+
+
+def write_tarball(path, fileobj):
+    """
+    Write an uncompressed tarball of the app at path to fileobj.
+    
+    Files are written in a stable order, and fileobj is only ever written
+    to, so it may be a pipe or a stream to another host.
+    """
+    path = os.path.normpath(path)
+    with tracing.span("write tarball") as tarball_span:
+        filenames = sorted(find_filenames(path))
+        archive = tarfile.open(fileobj=fileobj, mode="w|")
+        try:
+            for filename in filenames:
+                archive.add(
+                    os.path.join(path, filename),
+                    arcname=os.path.join(os.path.basename(path), filename),
+                    recursive=False,
+                )
+        finally:
+            archive.close()
+        tarball_span.set(files=len(filenames))
+
+
+def find_filenames(path):
+    import mayo
+    
+    with tracing.span("find filenames"):
+        repository = mayo.repository_at(path)
+        if repository is not None and repository.type == "git":
+            return _git_filenames(repository)
+        else:
+            return _all_filenames(path)
 
 
 def _git_filenames(repository):
-    ignored_files = repository.find_ignored_files()
+    working_directory = os.path.abspath(repository.working_directory)
+    try:
+        names = (
+            _tracked_git_names(working_directory) +
+            _list_git_names(working_directory, ["--others", "--exclude-standard"])
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return list(_walk_git_filenames(repository))
+    return _expand_git_names(working_directory, names)
+
+
+def _tracked_git_names(working_directory):
+    cache_key = _git_index_key(working_directory)
+    if cache_key is not None:
+        with _tracked_git_names_lock:
+            cached_names = _tracked_git_names_cache.get(cache_key)
+        if cached_names is not None:
+            return list(cached_names)
     
-    for filename in _all_filenames(repository.working_directory):
-        if filename not in ignored_files and not filename.startswith(".git/"):
-            yield filename
+    names = _list_git_names(working_directory, ["--cached"])
+    if cache_key is not None:
+        with _tracked_git_names_lock:
+            _tracked_git_names_cache[cache_key] = names
+    return list(names)
+
+
+# The names of tracked files are cached against the stat of the git index,
+# so listing an unchanged checkout again (such as when deploying the same
+# app to many targets) doesn't read the index again. Untracked files don't
+# change the index, so they are listed every time, and tracked files that
+# have since been deleted are dropped when the names are expanded. The
+# cache only lives as long as the process.
+_tracked_git_names_cache = {}
+_tracked_git_names_lock = threading.Lock()
+
+
+def _git_index_key(working_directory):
+    try:
+        index_stat = os.stat(os.path.join(working_directory, ".git", "index"))
+    except OSError:
+        return None
+    return (working_directory, index_stat.st_mtime, index_stat.st_size, index_stat.st_ino)
+
+
+def _list_git_files(working_directory):
+    names = _list_git_names(working_directory, ["--cached", "--others", "--exclude-standard"])
+    return _expand_git_names(working_directory, names)
+
+
+def _list_git_names(working_directory, options):
+    process = subprocess.Popen(
+        ["git", "ls-files", "-z"] + options,
+        cwd=working_directory,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    output, stderr_output = process.communicate()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, "git ls-files")
+    return [_decode_path(name) for name in output.split(b"\0") if name]
+
+
+def _expand_git_names(working_directory, names):
+    filenames = []
+    for filename in sorted(set(names)):
+        full_path = os.path.join(working_directory, filename)
+        if os.path.isdir(full_path) and not os.path.islink(full_path):
+            # Submodules are listed as a single directory entry
+            filenames += [
+                os.path.join(filename, submodule_filename)
+                for submodule_filename in _all_filenames(full_path)
+                if not _is_in_git_dir(submodule_filename)
+            ]
+        elif os.path.lexists(full_path):
+            filenames.append(filename)
+    return filenames
+
+
+def _walk_git_filenames(repository):
+    ignored_paths = set(
+        ignored_path.rstrip("/")
+        for ignored_path in repository.find_ignored_files()
+    )
+    ignored_paths.add(".git")
     
+    return _all_filenames(
+        repository.working_directory,
+        is_ignored=lambda relative_path: relative_path in ignored_paths,
+    )
 
 
-def _all_filenames(path):
-    result = []
+def _all_filenames(path, is_ignored=lambda relative_path: False):
     for root, dirs, filenames in os.walk(path):
+        relative_root = os.path.relpath(root, path)
+        if relative_root == os.curdir:
+            relative_root = ""
+        
+        dirs[:] = [
+            dir_name
+            for dir_name in dirs
+            if not is_ignored(os.path.join(relative_root, dir_name))
+        ]
         for filename in filenames:
-            full_path = os.path.join(root, filename)
-            yield os.path.relpath(full_path, path)
+            relative_path = os.path.join(relative_root, filename)
+            if not is_ignored(relative_path):
+                yield relative_path
+
+
+def _is_in_git_dir(relative_path):
+    return relative_path == ".git" or relative_path.startswith(".git" + os.sep)
+
+
+def _decode_path(path):
+    if isinstance(path, str):
+        return path
+    else:
+        return path.decode(sys.getfilesystemencoding())
@@ -0,0 +1,226 @@
+import json
+import os
+import sys
+import threading
+import time
+
+
+_tracer = None
+
+
+def start():
+    """
+    Start recording spans and counters, replacing any current tracer.
+    Until a tracer is started, spans cost no more than a function call.
+    """
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def stop():
+    global _tracer
+    tracer = _tracer
+    _tracer = None
+    return tracer
+
+
+def span(name, **args):
+    tracer = _tracer
+    if tracer is None:
+        return _null_span
+    else:
+        return _Span(tracer, name, args)
+
+
+def count(name, value=1):
+    tracer = _tracer
+    if tracer is not None:
+        tracer.count(name, value)
+
+
+class Tracer(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = []
+        self.counters = {}
+    
+    def add_span(self, name, start_time, end_time, args):
+        event = {
+            "name": name,
+            "cat": "beach",
+            "ph": "X",
+            "ts": int(start_time * 1000000),
+            "dur": int((end_time - start_time) * 1000000),
+            "pid": os.getpid(),
+            "tid": threading.current_thread().ident,
+            "args": args,
+        }
+        with self._lock:
+            self._events.append(event)
+    
+    def count(self, name, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+    
+    def events(self):
+        with self._lock:
+            events = sorted(self._events, key=lambda event: event["ts"])
+            counters = dict(self.counters)
+        
+        if events:
+            end_time = max(event["ts"] + event["dur"] for event in events)
+        else:
+            end_time = int(time.time() * 1000000)
+        events.append({
+            "name": "totals",
+            "cat": "beach",
+            "ph": "C",
+            "ts": end_time,
+            "pid": os.getpid(),
+            "args": counters,
+        })
+        return events
+    
+    def write(self, path):
+        """
+        Write the trace to path: as JSON lines if path ends with .jsonl,
+        otherwise in the Chrome trace event format.
+        """
+        events = self.events()
+        with open(path, "w") as trace_file:
+            if path.endswith(".jsonl"):
+                for event in events:
+                    trace_file.write(json.dumps(event, sort_keys=True) + "\n")
+            else:
+                json.dump({"traceEvents": events}, trace_file)
+
+
+class _Span(object):
+    def __init__(self, tracer, name, args):
+        self._tracer = tracer
+        self._name = name
+        self._args = args
+    
+    def set(self, **args):
+        self._args.update(args)
+    
+    def __enter__(self):
+        self._start_time = time.time()
+        return self
+    
+    def __exit__(self, exception_type, *args):
+        if exception_type is not None:
+            self._args["error"] = exception_type.__name__
+        self._tracer.add_span(self._name, self._start_time, time.time(), self._args)
+
+
+class _NullSpan(object):
+    def set(self, **args):
+        pass
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        pass
+
+
+_null_span = _NullSpan()
+
+
+class TracingShell(object):
+    """
+    Wraps a shell to record a span for each command and to count commands
+    and bytes sent, whenever a tracer has been started.
+    """
+    
+    def __init__(self, shell):
+        self._shell = shell
+    
+    def __getattr__(self, name):
+        return getattr(self._shell, name)
+    
+    def run(self, command, *args, **kwargs):
+        with span(_command_name(command)):
+            count("remote_commands")
+            return self._shell.run(command, *args, **kwargs)
+    
+    def spawn(self, command, *args, **kwargs):
+        process = self._shell.spawn(command, *args, **kwargs)
+        if _tracer is None:
+            return process
+        else:
+            count("remote_commands")
+            return _TracingProcess(process, span(_command_name(command)))
+    
+    def open(self, name, mode="r"):
+        remote_file = self._shell.open(name, mode)
+        if _tracer is None or "w" not in mode:
+            return remote_file
+        else:
+            return _TracingFile(remote_file)
+    
+    def close(self):
+        self._shell.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+
+
+def _command_name(command):
+    if command[:2] == ["sh", "-c"]:
+        # Scripts are too long to be useful names
+        return "sh -c"
+    else:
+        return command[0]
+
+
+class _TracingProcess(object):
+    def __init__(self, process, process_span):
+        self._process = process
+        self._span = process_span.__enter__()
+        self._bytes_sent = 0
+    
+    def __getattr__(self, name):
+        return getattr(self._process, name)
+    
+    def stdin_write(self, data):
+        self._bytes_sent += len(data)
+        count("bytes_sent", len(data))
+        self._process.stdin_write(data)
+    
+    def wait_for_result(self):
+        if self._span is None:
+            return self._process.wait_for_result()
+        
+        current_span, self._span = self._span, None
+        current_span.set(bytes_sent=self._bytes_sent)
+        try:
+            result = self._process.wait_for_result()
+        except:
+            current_span.__exit__(*sys.exc_info())
+            raise
+        current_span.__exit__(None, None, None)
+        return result
+
+
+class _TracingFile(object):
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+    
+    def __getattr__(self, name):
+        return getattr(self._fileobj, name)
+    
+    def write(self, data):
+        count("bytes_sent", len(data))
+        return self._fileobj.write(data)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self._fileobj.close()
@@ -0,0 +1,328 @@
+import contextlib
+import os
+import posixpath
+import stat
+import tarfile
+import hashlib
+import uuid
+
+from . import tarballs, tracing
+
+
+class TarballUploader(object):
+    """
+    Uploads the whole app as a tarball.
+    
+    The tarball is built in-process and streamed straight into tar on the
+    remote, so it is never written to disk on either side. The hash is of
+    the uncompressed tarball, computed as it is streamed.
+    """
+    
+    def __init__(self, shell, compression=None):
+        self._shell = shell
+        self._compression = compression
+    
+    def upload(self, path, destination, snapshot=None):
+        self._shell.run(["mkdir", "-p", destination])
+        with tracing.span("stream tarball") as stream_span:
+            with _stream_archive(self._shell, self._compression, ["-x", "--strip-components=1"], cwd=destination) as archive:
+                hashing_archive = _HashingWriter(archive)
+                tarballs.write_tarball(path, hashing_archive)
+            stream_span.set(uncompressed_bytes=hashing_archive.size)
+        return hashing_archive.hexdigest()
+
+
+class ContentAddressedUploader(object):
+    """
+    Uploads apps into a store of file contents keyed by their hash.
+    
+    Only files that the store doesn't already contain are sent, and the
+    destination directory is built from hardlinks into the store. Since
+    releases share inodes with the store, files in a release should be
+    replaced rather than modified in place.
+    """
+    
+    def __init__(self, shell, store_path, compression=None):
+        self._shell = shell
+        self._store_path = store_path
+        self._compression = compression
+    
+    def upload(self, path, destination, snapshot=None):
+        if snapshot is None:
+            snapshot = create_snapshot(path)
+        with tracing.span("find missing objects") as find_span:
+            keys = snapshot.keys()
+            missing_keys = self._find_missing_keys(keys)
+            find_span.set(objects=len(keys), missing_objects=len(missing_keys))
+        
+        # Objects are extracted into a directory of their own, and only
+        # moved into the store once complete, so that an interrupted upload
+        # can't leave truncated objects under their keys.
+        partial_path = posixpath.join(self._store_path, ".partial-{0}".format(uuid.uuid4()))
+        with tracing.span("stream objects"):
+            with _stream_archive(self._shell, self._compression, ["-xP"], lock_path=_lock_path(self._store_path)) as archive:
+                _write_checkout_archive(
+                    archive,
+                    snapshot,
+                    missing_keys=missing_keys,
+                    store_path=self._store_path,
+                    partial_path=partial_path,
+                    destination=destination,
+                )
+        if missing_keys:
+            self._shell.run(["sh", "-c", _move_objects_into_store_script, "sh", self._store_path, partial_path])
+        
+        return snapshot.hash
+    
+    def _find_missing_keys(self, keys):
+        remote_keys_path = _remote_temp_path()
+        with self._shell.open(remote_keys_path, "wb") as remote_keys_file:
+            remote_keys_file.write(_to_bytes("".join(key + "\n" for key in keys)))
+        
+        result = self._shell.run([
+            "sh", "-c", _find_missing_keys_script,
+            "sh", self._store_path, remote_keys_path, _lock_path(self._store_path),
+        ])
+        return set(result.output.decode("ascii").split())
+
+
+def _lock_path(store_path):
+    # Held shared while uploading, and exclusively while collecting garbage
+    return store_path + ".lock"
+
+
+# Objects that are already stored have their ctime reset, so that garbage
+# collection leaves them for the upload to link to.
+_find_missing_keys_script = """set -e
+mkdir -p "$1"
+exec 9> "$3"
+flock -s 9
+cd "$1"
+while read -r key; do
+    if [ -e "$key" ]; then echo "$key" >&3; else echo "$key"; fi
+done < "$2" 3> "$2.stored"
+if [ -s "$2.stored" ]; then xargs touch -c -a < "$2.stored"; fi
+rm -f "$2" "$2.stored"
+"""
+
+_move_objects_into_store_script = """set -e
+find "$2" -mindepth 1 -maxdepth 1 -exec sh -c 'mv -f "$@" "$0"' "$1" {} +
+rmdir "$2"
+"""
+
+
+def create_snapshot(path):
+    path = os.path.normpath(path)
+    entries = []
+    with tracing.span("create snapshot") as snapshot_span:
+        for filename in sorted(tarballs.find_filenames(path)):
+            full_path = os.path.join(path, filename)
+            relative_path = "/".join(filename.split(os.sep))
+            if os.path.islink(full_path):
+                entries.append(_SymlinkEntry(relative_path, os.readlink(full_path)))
+            else:
+                entries.append(_FileEntry(relative_path, full_path, _object_key(full_path)))
+        snapshot_span.set(files=len(entries))
+    return Snapshot(entries)
+
+
+class Snapshot(object):
+    def __init__(self, entries):
+        self.entries = entries
+        
+        hasher = hashlib.sha1()
+        for entry in entries:
+            hasher.update(_to_bytes(entry.manifest_line()))
+        self.hash = hasher.hexdigest()
+    
+    def keys(self):
+        return sorted(set(
+            entry.key
+            for entry in self.entries
+            if entry.key is not None
+        ))
+
+
+class _FileEntry(object):
+    def __init__(self, path, local_path, key):
+        self.path = path
+        self.local_path = local_path
+        self.key = key
+    
+    def manifest_line(self):
+        return "file {0} {1}\n".format(self.key, self.path)
+
+
+class _SymlinkEntry(object):
+    key = None
+    
+    def __init__(self, path, target):
+        self.path = path
+        self.target = target
+    
+    def manifest_line(self):
+        return "link {0} {1}\n".format(self.target, self.path)
+
+
+def _object_key(path):
+    with open(path, "rb") as fileobj:
+        content_hash = _file_hash(fileobj)
+    mode = stat.S_IMODE(os.stat(path).st_mode)
+    return "{0}-{1:o}".format(content_hash, mode)
+
+
+def _write_checkout_archive(fileobj, app_snapshot, missing_keys, store_path, partial_path, destination):
+    archive = tarfile.open(fileobj=fileobj, mode="w|")
+    try:
+        written_keys = set()
+        for entry in app_snapshot.entries:
+            if entry.key in missing_keys and entry.key not in written_keys:
+                written_keys.add(entry.key)
+                object_info = _tar_info(posixpath.join(partial_path, entry.key))
+                object_info.size = os.path.getsize(entry.local_path)
+                object_info.mode = int(entry.key.rsplit("-", 1)[1], 8)
+                with open(entry.local_path, "rb") as object_file:
+                    archive.addfile(object_info, object_file)
+        
+        for entry in app_snapshot.entries:
+            link_info = _tar_info(posixpath.join(destination, entry.path))
+            if entry.key is None:
+                link_info.type = tarfile.SYMTYPE
+                link_info.linkname = entry.target
+            else:
+                link_info.type = tarfile.LNKTYPE
+                if entry.key in missing_keys:
+                    link_info.linkname = posixpath.join(partial_path, entry.key)
+                else:
+                    link_info.linkname = posixpath.join(store_path, entry.key)
+            archive.addfile(link_info)
+    finally:
+        archive.close()
+
+
+def _tar_info(name):
+    info = tarfile.TarInfo(name)
+    info.uid = info.gid = 0
+    info.uname = info.gname = "root"
+    return info
+
+
+@contextlib.contextmanager
+def _stream_archive(shell, compression, tar_options, cwd=None, lock_path=None):
+    if compression is None:
+        compression = tarballs.default_compression
+    
+    tar_command = ["tar"] + tar_options + compression.tar_options + ["-f", "-"]
+    if lock_path is not None:
+        tar_command = ["flock", "-s", lock_path] + tar_command
+    stream = _RemoteStream(shell, tar_command, cwd=cwd)
+    try:
+        with compression.compress(stream) as compressed_stream:
+            yield compressed_stream
+    except:
+        stream.abort()
+        raise
+    stream.close()
+
+
+class _RemoteStream(object):
+    """
+    A writable stream into the stdin of a remote command.
+    
+    spur can't close the stdin of a remote process, so data is sent in
+    chunks, each preceded by its size, and a zero size marks the end of the
+    stream. The remote side reassembles the chunks with head before piping
+    them into the command.
+    """
+    
+    _chunk_size = 1024 * 1024
+    
+    def __init__(self, shell, command, cwd=None):
+        self._process = shell.spawn(
+            ["sh", "-c", _read_chunks_script, "sh"] + command,
+            cwd=cwd,
+        )
+        self._buffer = []
+        self._buffer_size = 0
+    
+    def write(self, data):
+        self._buffer.append(data)
+        self._buffer_size += len(data)
+        if self._buffer_size >= self._chunk_size:
+            self._flush_buffer()
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        self._flush_buffer()
+        self._send(b"0\n")
+        self._process.wait_for_result()
+    
+    def abort(self):
+        try:
+            self._send(b"0\n")
+        except IOError:
+            pass
+        try:
+            self._process.wait_for_result()
+        except Exception:
+            pass
+    
+    def _flush_buffer(self):
+        if self._buffer_size > 0:
+            data = b"".join(self._buffer)
+            self._buffer = []
+            self._buffer_size = 0
+            self._send("{0}\n".format(len(data)).encode("ascii") + data)
+    
+    def _send(self, data):
+        try:
+            self._process.stdin_write(data)
+        except IOError:
+            # The remote command has exited early, so report its error
+            self._process.wait_for_result()
+            raise
+
+
+_read_chunks_script = """
+while read -r size && [ "$size" -gt 0 ]; do
+    head -c "$size"
+done | "$@"
+"""
+
+
+class _HashingWriter(object):
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._hasher = hashlib.sha1()
+        self.size = 0
+    
+    def write(self, data):
+        self._hasher.update(data)
+        self.size += len(data)
+        self._fileobj.write(data)
+    
+    def hexdigest(self):
+        return self._hasher.hexdigest()
+
+
+def _remote_temp_path():
+    return posixpath.join("/tmp", str(uuid.uuid4()))
+
+
+def _file_hash(fileobj):
+    hasher = hashlib.sha1()
+    while True:
+        data = fileobj.read(8192)
+        if not data:
+            break
+        hasher.update(data)
+    return hasher.hexdigest()
+
+
+def _to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    else:
+        return value.encode("utf8")
@@ -0,0 +1,48 @@
+import sys
+import time
+
+
+def watch(deployer, registry, batch_delay=0.2, poll_interval=1, stop=None, on_error=None):
+    """
+    Update the apps deployed by deployer whenever the registry changes,
+    until stop() returns true.
+    
+    Registries that can wait for changes, such as HttpRegistry, are watched
+    without polling; other registries have their version polled. Changes
+    arriving within batch_delay of each other are applied together.
+    
+    If updating the apps fails, the error is passed to on_error, which by
+    default writes it to stderr, and the update is tried again on the next
+    change.
+    """
+    if stop is None:
+        stop = lambda: False
+    if on_error is None:
+        on_error = _write_error
+    
+    wait_for_change = getattr(registry, "watch", None)
+    if wait_for_change is None:
+        wait_for_change = _poller(registry, poll_interval)
+    
+    version = registry.version()
+    while not stop():
+        new_version = wait_for_change(version)
+        if new_version != version and not stop():
+            time.sleep(batch_delay)
+            version = registry.version()
+            try:
+                deployer.update_dependents()
+            except Exception as error:
+                on_error(error)
+
+
+def _poller(registry, poll_interval):
+    def wait_for_change(version):
+        time.sleep(poll_interval)
+        return registry.version()
+    
+    return wait_for_change
+
+
+def _write_error(error):
+    sys.stderr.write("Failed to update dependents: {0}\n".format(error))
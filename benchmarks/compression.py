@@ -0,0 +1,56 @@
+"""
+Compare the size of the compressed app tarball and the time taken to
+build it for each compression codec, level and thread count.
+
+    python -m benchmarks.compression [file-count] [file-size]
+"""
+
+import os
+import sys
+
+from beach import tarballs
+from .harness import run_cases, create_tree, TemporaryDirectory
+
+
+def main(file_count=2000, file_size=32 * 1024):
+    options = [
+        ("none", None, 1),
+        ("gzip", 1, 1),
+        ("gzip", 6, 1),
+        ("gzip", 9, 1),
+        ("gzip", 6, 0),
+        ("zstd", 1, 1),
+        ("zstd", 3, 1),
+        ("zstd", 3, 0),
+        ("zstd", 9, 0),
+    ]
+    
+    with TemporaryDirectory() as temp_dir:
+        app_path = os.path.join(temp_dir, "app")
+        create_tree(app_path, file_count=file_count, file_size=file_size, compressible=True)
+        
+        def compress(compression):
+            def run():
+                try:
+                    with tarballs.create_temp_tarball(app_path, compression=compression) as tarball:
+                        return {
+                            "compressed_bytes": os.path.getsize(tarball.name),
+                            "uncompressed_bytes": file_count * file_size,
+                        }
+                except OSError:
+                    # The compression command isn't installed
+                    return {"unavailable": True}
+            return run
+        
+        cases = [
+            (
+                "{0}/level-{1}/threads-{2}".format(codec, level, threads),
+                compress(tarballs.Compression(codec, level=level, threads=threads)),
+            )
+            for codec, level, threads in options
+        ]
+        return run_cases("compression", cases)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
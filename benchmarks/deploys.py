@@ -0,0 +1,67 @@
+"""
+Deploy an app end to end with the TemporaryLayout and the StopOnExit
+supervisor, for a first deploy, an unchanged redeploy and a redeploy
+with one changed file, reporting the time spent in each phase.
+
+    python -m benchmarks.deploys [file-count] [file-size]
+"""
+
+import os
+import shutil
+import sys
+
+import beach
+from beach import tracing
+from .harness import run_cases, create_tree, TemporaryDirectory
+
+
+def main(file_count=1000, file_size=4 * 1024):
+    with TemporaryDirectory() as temp_dir:
+        app_path = os.path.join(temp_dir, "app")
+        shutil.copytree(os.path.join(os.path.dirname(__file__), "../example-apps/just-a-script"), app_path)
+        create_tree(os.path.join(app_path, "data"), file_count=file_count, file_size=file_size)
+        
+        def change_one_file():
+            with open(os.path.join(app_path, "data", "dir-0", "file-0"), "wb") as changed_file:
+                changed_file.write(os.urandom(file_size))
+        
+        with beach.layouts.TemporaryLayout() as layout:
+            with beach.supervisors.stop_on_exit() as supervisor:
+                deployer = beach.Deployer(
+                    registry=beach.registries.InMemoryRegistry(),
+                    layout=layout,
+                    supervisor=supervisor,
+                )
+                deploy = _deploy(deployer, app_path, file_count)
+                return run_cases("deploys", [
+                    ("initial", deploy),
+                    ("unchanged", deploy),
+                    ("one-file-changed", _then(change_one_file, deploy)),
+                ])
+
+
+def _deploy(deployer, app_path, file_count):
+    def run():
+        tracer = tracing.start()
+        try:
+            deployer.deploy(app_path, params={"port": "58090"})
+        finally:
+            tracing.stop()
+        
+        phases = {}
+        for event in tracer.events():
+            if event["ph"] == "X" and event["name"] != "deploy":
+                phases[event["name"]] = phases.get(event["name"], 0) + event["dur"] / 1000000.0
+        return {"files": file_count, "phases": phases}
+    return run
+
+
+def _then(before, func):
+    def run():
+        before()
+        return func()
+    return run
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
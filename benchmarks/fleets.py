@@ -0,0 +1,95 @@
+"""
+Deploy an app to many fake targets, one after another and then in
+parallel. Each target is a local directory reached through a LocalShell
+that adds a fixed latency to every operation.
+
+    python -m benchmarks.fleets [target-count] [latency-seconds]
+"""
+
+import os
+import sys
+
+import spur
+
+import beach
+from beach import fleets, uploads, registries, layouts
+from .harness import run_cases, create_tree, TemporaryDirectory, LatencyShell
+
+
+def main(target_count=20, latency=0.05):
+    with TemporaryDirectory() as temp_dir:
+        app_path = os.path.join(temp_dir, "app")
+        create_tree(app_path, file_count=200, file_size=4096)
+        with open(os.path.join(app_path, "beach.json"), "w") as config_file:
+            config_file.write('{"name": "app", "install": "true", "service": "true"}')
+        
+        def deploy(max_workers):
+            def run():
+                targets_path = os.path.join(temp_dir, "targets-{0}".format(max_workers))
+                targets = [
+                    (str(index), _fake_target_deployer(os.path.join(targets_path, str(index)), latency))
+                    for index in range(target_count)
+                ]
+                results = fleets.deploy(targets, app_path, params={}, max_workers=max_workers)
+                return {
+                    "targets": target_count,
+                    "failures": len([result for result in results if not result.succeeded]),
+                }
+            return run
+        
+        return run_cases("fleets", [
+            ("serial", deploy(max_workers=1)),
+            ("parallel", deploy(max_workers=target_count)),
+        ])
+
+
+def _fake_target_deployer(path, latency):
+    shell = LatencyShell(spur.LocalShell(), latency)
+    return beach.Deployer(
+        registry=registries.InMemoryRegistry(),
+        layout=_DirectoryLayout(shell, path),
+        supervisor=_NullSupervisor(shell),
+    )
+
+
+class _DirectoryLayout(object):
+    def __init__(self, shell, path):
+        self._shell = shell
+        self._path = path
+        self.run = shell.run
+    
+    def upload_service(self, service_name, path, snapshot=None, install_command=None):
+        uploader = uploads.ContentAddressedUploader(self._shell, os.path.join(self._path, "objects"))
+        app_path = os.path.join(self._path, service_name)
+        uploader.upload(path, app_path, snapshot=snapshot)
+        return layouts.Release(app_path, username=None)
+    
+    def mark_installed(self, release):
+        pass
+    
+    def activate(self, release):
+        return release.path
+    
+    def remove_old_releases(self, release):
+        pass
+    
+    def restore_install_cache(self, release, key, paths):
+        return False
+    
+    def save_install_cache(self, release, key):
+        pass
+
+
+class _NullSupervisor(object):
+    def __init__(self, shell):
+        self._shell = shell
+    
+    def install(self):
+        self._shell.run(["true"])
+    
+    def set_up(self, service_name, cwd, username, command, reload_signal=None, listen_port=None):
+        self._shell.run(["true"])
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20, *map(float, sys.argv[2:]))
@@ -0,0 +1,156 @@
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+
+def run_cases(benchmark_name, cases):
+    results = []
+    for case_name, func in cases:
+        start = time.time()
+        metrics = func() or {}
+        result = {"case": case_name, "seconds": time.time() - start}
+        result.update(metrics)
+        results.append(result)
+    
+    report = {"benchmark": benchmark_name, "results": results}
+    if _collectors:
+        _collectors[-1].append(report)
+    else:
+        json.dump(report, sys.stdout, indent=4, sort_keys=True)
+        sys.stdout.write("\n")
+    return report
+
+
+_collectors = []
+
+
+@contextlib.contextmanager
+def collecting_reports():
+    """
+    Collect the reports of benchmarks run in the block instead of printing
+    them.
+    """
+    reports = []
+    _collectors.append(reports)
+    try:
+        yield reports
+    finally:
+        _collectors.pop()
+
+
+def create_tree(path, file_count, file_size, files_per_dir=100, compressible=False):
+    generate = _text if compressible else os.urandom
+    for index in range(file_count):
+        dir_path = os.path.join(path, "dir-{0}".format(index // files_per_dir))
+        if not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+        with open(os.path.join(dir_path, "file-{0}".format(index)), "wb") as target:
+            target.write(generate(file_size))
+
+
+def _text(size):
+    words = [b"def", b"return", b"self", b"import", b"value", b"class", b"None", b"\n    "]
+    chunks = []
+    length = 0
+    while length < size:
+        chunk = words[ord(os.urandom(1)[0:1]) % len(words)] + b" "
+        chunks.append(chunk)
+        length += len(chunk)
+    return b"".join(chunks)[:size]
+
+
+class TemporaryDirectory(object):
+    def __enter__(self):
+        self.path = tempfile.mkdtemp()
+        return self.path
+    
+    def __exit__(self, *args):
+        shutil.rmtree(self.path)
+
+
+class CountingShell(object):
+    def __init__(self, shell):
+        self._shell = shell
+        self.bytes_sent = 0
+        self.commands = 0
+    
+    def run(self, *args, **kwargs):
+        self.commands += 1
+        return self._shell.run(*args, **kwargs)
+    
+    def spawn(self, *args, **kwargs):
+        self.commands += 1
+        return _CountingProcess(self._shell.spawn(*args, **kwargs), self)
+    
+    def open(self, name, mode="r"):
+        fileobj = self._shell.open(name, mode)
+        if "r" in mode:
+            return fileobj
+        else:
+            return _CountingFile(fileobj, self)
+    
+    def reset(self):
+        self.bytes_sent = 0
+        self.commands = 0
+
+
+class LatencyShell(object):
+    """
+    Wraps a shell so that each remote operation pays a fixed round trip,
+    standing in for a shell connected to a distant host.
+    """
+    
+    def __init__(self, shell, latency):
+        self._shell = shell
+        self._latency = latency
+    
+    def run(self, *args, **kwargs):
+        time.sleep(self._latency)
+        return self._shell.run(*args, **kwargs)
+    
+    def spawn(self, *args, **kwargs):
+        time.sleep(self._latency)
+        return self._shell.spawn(*args, **kwargs)
+    
+    def open(self, *args, **kwargs):
+        time.sleep(self._latency)
+        return self._shell.open(*args, **kwargs)
+
+
+class _CountingProcess(object):
+    def __init__(self, process, shell):
+        self._process = process
+        self._shell = shell
+    
+    def stdin_write(self, data):
+        self._shell.bytes_sent += len(data)
+        return self._process.stdin_write(data)
+    
+    def __getattr__(self, name):
+        return getattr(self._process, name)
+
+
+class _CountingFile(object):
+    def __init__(self, fileobj, shell):
+        self._fileobj = fileobj
+        self._shell = shell
+    
+    def write(self, data):
+        self._shell.bytes_sent += len(data)
+        return self._fileobj.write(data)
+    
+    def close(self):
+        self._fileobj.close()
+    
+    def __getattr__(self, name):
+        return getattr(self._fileobj, name)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
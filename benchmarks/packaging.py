@@ -0,0 +1,44 @@
+"""
+Build the temporary tarball of synthetic apps of varying size and file
+count, as used when uploading apps.
+
+    python -m benchmarks.packaging [scale]
+"""
+
+import os
+import sys
+
+from beach import tarballs
+from .harness import run_cases, create_tree, TemporaryDirectory
+
+
+def main(scale=1.0):
+    trees = [
+        ("small", int(100 * scale), 1024),
+        ("many-files", int(10000 * scale), 1024),
+        ("large-files", int(50 * scale), 1024 * 1024),
+    ]
+    with TemporaryDirectory() as temp_dir:
+        cases = []
+        for tree_name, file_count, file_size in trees:
+            app_path = os.path.join(temp_dir, tree_name)
+            create_tree(app_path, file_count=max(1, file_count), file_size=file_size, compressible=True)
+            cases.append((tree_name, _package(app_path, file_count, file_size)))
+        
+        return run_cases("packaging", cases)
+
+
+def _package(app_path, file_count, file_size):
+    def run():
+        with tarballs.create_temp_tarball(app_path) as tarball:
+            tarball_size = os.path.getsize(tarball.name)
+        return {
+            "files": file_count,
+            "bytes": file_count * file_size,
+            "tarball_bytes": tarball_size,
+        }
+    return run
+
+
+if __name__ == "__main__":
+    main(*map(float, sys.argv[1:]))
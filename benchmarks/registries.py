@@ -0,0 +1,110 @@
+"""
+Register services from several writer processes at once and look them up,
+comparing the JSON FileRegistry with the SqliteRegistry.
+
+    python -m benchmarks.registries [service-count] [writer-count]
+"""
+
+import json
+import multiprocessing
+import os
+import sys
+
+import spur
+
+from beach import registries
+from .harness import run_cases, TemporaryDirectory
+
+
+def main(service_count=10000, writer_count=4):
+    with TemporaryDirectory() as temp_dir:
+        sqlite_path = os.path.join(temp_dir, "registry.sqlite")
+        file_path = os.path.join(temp_dir, "registry.json")
+        
+        # The file registry rewrites the whole file on every registration,
+        # so it is preloaded and only a few writes are made in parallel.
+        # Lookups are measured first since concurrent writes can corrupt it.
+        file_writes = min(service_count, 50 * writer_count)
+        with open(file_path, "w") as registry_file:
+            json.dump(
+                dict((_name(index), {"provides": {}}) for index in range(file_writes, service_count)),
+                registry_file,
+            )
+        
+        return run_cases("registries", [
+            ("sqlite/parallel-register", _register(_sqlite_registry, sqlite_path, 0, service_count, writer_count)),
+            ("sqlite/find-service", _find(_sqlite_registry, sqlite_path, service_count)),
+            ("file/find-service", _find(_file_registry, file_path, service_count, lookups=100)),
+            ("file/parallel-register", _register(_file_registry, file_path, 0, file_writes, writer_count)),
+        ])
+
+
+# Registries are created from module-level functions and their paths, so
+# that writer processes can be started with spawn as well as fork
+def _sqlite_registry(path):
+    return registries.SqliteRegistry(path)
+
+
+def _file_registry(path):
+    return registries.FileRegistry(spur.LocalShell(), path)
+
+
+def _register(create_registry, path, start, end, writer_count):
+    def run():
+        errors = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=_register_range,
+                args=(create_registry, path, range(start + writer_index, end, writer_count), errors),
+            )
+            for writer_index in range(writer_count)
+        ]
+        for process in processes:
+            process.start()
+        failed_registrations = sum(errors.get() for process in processes)
+        for process in processes:
+            process.join()
+        
+        result = {
+            "writers": writer_count,
+            "registrations": end - start,
+            "failed_registrations": failed_registrations,
+        }
+        try:
+            services = create_registry(path).find_services(_name(index) for index in range(start, end))
+            result["lost_registrations"] = len([service for service in services.values() if service is None])
+        except ValueError:
+            result["corrupted"] = True
+        return result
+    return run
+
+
+def _register_range(create_registry, path, indices, errors):
+    registry = create_registry(path)
+    failed_registrations = 0
+    for index in indices:
+        try:
+            registry.register(_name(index), provides={"index": str(index)})
+        except ValueError:
+            failed_registrations += 1
+    errors.put(failed_registrations)
+
+
+def _find(create_registry, path, service_count, lookups=1000):
+    def run():
+        registry = create_registry(path)
+        try:
+            for lookup_index in range(lookups):
+                registry.find_service(_name((lookup_index * 7919) % service_count))
+        except ValueError:
+            return {"lookups": lookups, "services": service_count, "corrupted": True}
+        return {"lookups": lookups, "services": service_count}
+    return run
+
+
+def _name(index):
+    return "service-{0}".format(index)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
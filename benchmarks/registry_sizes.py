@@ -0,0 +1,80 @@
+"""
+Register and look up a service in registries that already hold from ten
+to a hundred thousand services, comparing the JSON FileRegistry with the
+SqliteRegistry.
+
+    python -m benchmarks.registry_sizes [max-service-count]
+"""
+
+import json
+import os
+import sqlite3
+import sys
+
+import spur
+
+from beach import registries
+from .harness import run_cases, TemporaryDirectory
+
+
+def main(max_service_count=100000):
+    sizes = [size for size in [10, 100, 1000, 10000, 100000] if size <= max_service_count]
+    with TemporaryDirectory() as temp_dir:
+        cases = []
+        for size in sizes:
+            file_registry = _file_registry(os.path.join(temp_dir, "registry-{0}.json".format(size)), size)
+            sqlite_registry = _sqlite_registry(os.path.join(temp_dir, "registry-{0}.sqlite".format(size)), size)
+            for registry_name, registry in [("file", file_registry), ("sqlite", sqlite_registry)]:
+                cases += [
+                    ("{0}/{1}/register".format(registry_name, size), _register(registry, size)),
+                    ("{0}/{1}/find-service".format(registry_name, size), _find(registry, size)),
+                ]
+        
+        return run_cases("registry-sizes", cases)
+
+
+def _file_registry(path, size):
+    with open(path, "w") as registry_file:
+        json.dump(
+            dict((_name(index), {"provides": {"index": str(index)}}) for index in range(size)),
+            registry_file,
+        )
+    return registries.FileRegistry(spur.LocalShell(), path)
+
+
+def _sqlite_registry(path, size):
+    registry = registries.SqliteRegistry(path)
+    # Creates the table, which is then filled in a single transaction
+    registry.find_services([])
+    connection = sqlite3.connect(path)
+    try:
+        with connection:
+            connection.executemany(
+                "INSERT INTO services (name, provides) VALUES (?, ?)",
+                ((_name(index), json.dumps({"index": str(index)})) for index in range(size)),
+            )
+    finally:
+        connection.close()
+    return registry
+
+
+def _register(registry, size):
+    def run():
+        registry.register(_name(size), provides={"index": str(size)})
+        return {"services": size}
+    return run
+
+
+def _find(registry, size):
+    def run():
+        assert registry.find_service(_name(size // 2)) is not None
+        return {"services": size}
+    return run
+
+
+def _name(index):
+    return "service-{0}".format(index)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
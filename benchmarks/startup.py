@@ -0,0 +1,107 @@
+"""
+Start the CLI in a fresh interpreter for each subcommand, reporting the
+time taken and the number of modules imported, so that imports creeping
+onto the startup path show up.
+
+Subcommands are started with --help, which reaches each subcommand's
+parser without doing any work. register and deregister, which are run
+many times by automation, are also run for real against local
+registries.
+
+    python -m benchmarks.startup [repeats]
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+from .harness import run_cases, TemporaryDirectory
+
+
+_root = os.path.normpath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Each run of register and deregister uses a different service, so that
+# every deregister has a service to remove
+_service_name = "web-{0}"
+
+_subcommands = ["deploy", "deploy-stack", "gc", "register", "deregister", "registry-serve"]
+
+
+def main(repeats=20):
+    with TemporaryDirectory() as temp_dir:
+        sqlite_config = _write_config(temp_dir, "sqlite.json", {
+            "registry": {"type": "sqlite", "path": os.path.join(temp_dir, "registry.sqlite")},
+        })
+        file_config = _write_config(temp_dir, "file.json", {
+            "registry": {"type": "file", "path": os.path.join(temp_dir, "registry.json")},
+        })
+        
+        cases = [
+            ("python", _start(["-c", "pass"], repeats)),
+            ("import-beach", _start(["-c", "import beach"], repeats)),
+            ("help", _start_cli(["--help"], repeats)),
+        ]
+        cases += [
+            ("{0}/help".format(subcommand), _start_cli([subcommand, "--help"], repeats))
+            for subcommand in _subcommands
+        ]
+        cases += [
+            ("register/{0}".format(registry_type), _start_cli(["register", _service_name, "--config", config, "-p", "port=8080"], repeats))
+            for registry_type, config in [("sqlite", sqlite_config), ("file", file_config)]
+        ]
+        cases += [
+            ("deregister/{0}".format(registry_type), _start_cli(["deregister", _service_name, "--config", config], repeats))
+            for registry_type, config in [("sqlite", sqlite_config), ("file", file_config)]
+        ]
+        return run_cases("startup", cases)
+
+
+def _write_config(temp_dir, name, config):
+    path = os.path.join(temp_dir, name)
+    with open(path, "w") as config_file:
+        json.dump(config, config_file)
+    return path
+
+
+def _start_cli(args, repeats):
+    # Runs the script as __main__, then reports the modules it imported
+    code = "\n".join([
+        "import runpy, sys",
+        "sys.argv = sys.argv[1:]",
+        "try:",
+        "    runpy.run_path(sys.argv[0], run_name='__main__')",
+        "finally:",
+        "    sys.stderr.write('modules=' + str(len(sys.modules)) + '\\n')",
+    ])
+    return _start(["-c", code, os.path.join(_root, "scripts/beach")] + args, repeats)
+
+
+def _start(args, repeats):
+    def start():
+        env = os.environ.copy()
+        env["PYTHONPATH"] = _root
+        for index in range(repeats):
+            process = subprocess.Popen(
+                [sys.executable, "-W", "ignore"] + [arg.format(index) for arg in args],
+                env=env,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            stdout, stderr = process.communicate()
+            if process.returncode != 0:
+                raise Exception("Command failed: {0}\n{1}".format(args, stderr.decode("utf8")))
+        
+        modules = [
+            int(line[len("modules="):])
+            for line in stderr.decode("utf8").splitlines()
+            if line.startswith("modules=")
+        ]
+        if modules:
+            return {"modules": modules[-1]}
+    
+    return start
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
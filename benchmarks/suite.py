@@ -0,0 +1,108 @@
+"""
+Run every benchmark and write the results as a single JSON document, or
+compare them with the results of an earlier run to catch regressions.
+
+    python -m benchmarks.suite [--quick] [--output PATH] [--compare PATH] [benchmark ...]
+
+Comparing exits with a non-zero status if any case is slower than the
+same case in the earlier run by more than the threshold.
+"""
+
+import argparse
+import importlib
+import json
+import platform
+import sys
+
+from .harness import collecting_reports
+
+
+# Each benchmark with the arguments used for a quick run
+_benchmarks = [
+    ("packaging", (0.1, )),
+    ("tarballs", (10000, )),
+    ("compression", (200, )),
+    ("uploads", (200, )),
+    ("registries", (1000, 2)),
+    ("registry_sizes", (10000, )),
+    ("templates", (1000, )),
+    ("deploys", (100, )),
+    ("startup", (3, )),
+    ("fleets", (5, )),
+]
+
+_format_version = 1
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmarks", nargs="*", metavar="benchmark")
+    parser.add_argument("--quick", action="store_true")
+    parser.add_argument("--output")
+    parser.add_argument("--compare")
+    parser.add_argument("--threshold", type=float, default=1.5)
+    parser.add_argument("--min-seconds", type=float, default=0.01)
+    args = parser.parse_args(argv)
+    
+    names = args.benchmarks or [name for name, quick_args in _benchmarks]
+    results = {
+        "format": _format_version,
+        "python": platform.python_version(),
+        "platform": sys.platform,
+        "quick": args.quick,
+        "benchmarks": run(names, quick=args.quick),
+    }
+    
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=4, sort_keys=True)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=4, sort_keys=True)
+    
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = find_regressions(baseline, results, threshold=args.threshold, min_seconds=args.min_seconds)
+        for regression in regressions:
+            sys.stderr.write("{0}/{1}: {2:.3f}s, was {3:.3f}s\n".format(*regression))
+        if regressions:
+            sys.exit(1)
+
+
+def run(names, quick):
+    quick_args = dict(_benchmarks)
+    with collecting_reports() as reports:
+        for name in names:
+            module = importlib.import_module("benchmarks." + name)
+            if quick:
+                module.main(*quick_args[name])
+            else:
+                module.main()
+    return reports
+
+
+def find_regressions(baseline, results, threshold, min_seconds):
+    """
+    Find the cases that took more than threshold times as long as in the
+    baseline, ignoring differences smaller than min_seconds.
+    """
+    baseline_seconds = dict(
+        ((report["benchmark"], result["case"]), result["seconds"])
+        for report in baseline["benchmarks"]
+        for result in report["results"]
+    )
+    regressions = []
+    for report in results["benchmarks"]:
+        for result in report["results"]:
+            key = (report["benchmark"], result["case"])
+            previous = baseline_seconds.get(key)
+            if previous is not None:
+                seconds = result["seconds"]
+                if seconds > previous * threshold and seconds - previous > min_seconds:
+                    regressions.append((report["benchmark"], result["case"], seconds, previous))
+    return regressions
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
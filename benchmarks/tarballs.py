@@ -0,0 +1,56 @@
+"""
+List the files in a synthetic git repository, most of which are in an
+ignored node_modules directory, comparing an unpruned walk with git
+ls-files and with the listing that caches the names of tracked files.
+
+    python -m benchmarks.tarballs [file-count]
+"""
+
+import os
+import subprocess
+import sys
+
+import mayo
+
+from beach import tarballs
+from .harness import run_cases, create_tree, TemporaryDirectory
+
+
+def main(file_count=100000):
+    with TemporaryDirectory() as repo_path:
+        app_file_count = max(1, file_count // 10)
+        create_tree(os.path.join(repo_path, "src"), file_count=app_file_count, file_size=0)
+        create_tree(os.path.join(repo_path, "node_modules"), file_count=file_count - app_file_count, file_size=0)
+        with open(os.path.join(repo_path, ".gitignore"), "w") as gitignore:
+            gitignore.write("/node_modules\n")
+        subprocess.check_call(["git", "init", "-q"], cwd=repo_path)
+        subprocess.check_call(["git", "add", "."], cwd=repo_path)
+        
+        repository = mayo.repository_at(repo_path)
+        
+        def count(find_filenames):
+            def run():
+                return {"files": len(list(find_filenames())), "total_files": file_count}
+            return run
+        
+        return run_cases("tarballs", [
+            ("unpruned-walk", count(lambda: _unpruned_walk(repository))),
+            ("pruned-walk", count(lambda: tarballs._walk_git_filenames(repository))),
+            ("git-ls-files", count(lambda: tarballs._list_git_files(repo_path))),
+            ("find-filenames/first", count(lambda: tarballs.find_filenames(repo_path))),
+            ("find-filenames/cached", count(lambda: tarballs.find_filenames(repo_path))),
+        ])
+
+
+def _unpruned_walk(repository):
+    # How files were listed before ignored directories were pruned
+    ignored_files = set(repository.find_ignored_files())
+    for root, dirs, filenames in os.walk(repository.working_directory):
+        for filename in filenames:
+            relative_path = os.path.relpath(os.path.join(root, filename), repository.working_directory)
+            if relative_path not in ignored_files and not relative_path.startswith(".git/"):
+                yield relative_path
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
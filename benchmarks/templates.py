@@ -0,0 +1,41 @@
+"""
+Generate the install and service commands of many apps, as a deploy does
+for each app on each target.
+
+    python -m benchmarks.templates [app-count]
+"""
+
+import pipes
+import sys
+
+from beach import apps
+from .harness import run_cases
+
+
+def main(app_count=10000):
+    params = dict(("param{0}".format(index), "value {0}".format(index)) for index in range(50))
+    params["port"] = "8080"
+    dependencies = {"db": {"url": "postgres://localhost/app", "user": "app"}}
+    app_configs = [
+        {
+            "name": "app-{0}".format(index),
+            "install": "./install --db ${db.url} --user ${db.user}",
+            "service": "./server-{0} ${{port}} ${{db.url}} ${{param1}} ${{param2}}".format(index % 10),
+        }
+        for index in range(app_count)
+    ]
+    
+    def generate_commands():
+        for app_config in app_configs:
+            env = apps.Environment(params, dependencies)
+            apps.missing_variables(app_config, env)
+            for command_name in ["install", "service"]:
+                apps.render(app_config[command_name], env, quote=pipes.quote)
+    
+    return run_cases("templates", [
+        ("{0}-apps".format(app_count), generate_commands),
+    ])
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,58 @@
+"""
+Compare the bytes sent and time taken by the tarball and content-addressed
+uploaders, for a first upload, an unchanged redeploy and a redeploy with
+one changed file.
+
+    python -m benchmarks.uploads [file-count] [file-size]
+"""
+
+import os
+import sys
+
+import spur
+
+from beach import uploads
+from .harness import run_cases, create_tree, TemporaryDirectory, CountingShell
+
+
+def main(file_count=2000, file_size=16 * 1024):
+    with TemporaryDirectory() as temp_dir:
+        app_path = os.path.join(temp_dir, "app")
+        create_tree(app_path, file_count=file_count, file_size=file_size)
+        shell = CountingShell(spur.LocalShell())
+        uploaders = [
+            ("tarball", uploads.TarballUploader(shell)),
+            ("content-addressed", uploads.ContentAddressedUploader(shell, os.path.join(temp_dir, "store"))),
+        ]
+        
+        def upload(uploader, name):
+            def run():
+                shell.reset()
+                uploader.upload(app_path, os.path.join(temp_dir, "releases", name))
+                return {"bytes_sent": shell.bytes_sent, "commands": shell.commands}
+            return run
+        
+        def change_one_file():
+            with open(os.path.join(app_path, "dir-0", "file-0"), "wb") as changed_file:
+                changed_file.write(os.urandom(file_size))
+        
+        cases = []
+        for uploader_name, uploader in uploaders:
+            cases += [
+                ("{0}/initial".format(uploader_name), upload(uploader, uploader_name + "-1")),
+                ("{0}/unchanged".format(uploader_name), upload(uploader, uploader_name + "-2")),
+                ("{0}/one-file-changed".format(uploader_name), _then(change_one_file, upload(uploader, uploader_name + "-3"))),
+            ]
+        
+        return run_cases("uploads", cases)
+
+
+def _then(before, func):
+    def run():
+        before()
+        return func()
+    return run
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+import os
+import socket
 import sys
 from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
 
@@ -11,7 +13,12 @@ class HttpHandler(BaseHTTPRequestHandler):
 		self.wfile.write("Hello")
 
 try:
-	server = HTTPServer(('', int(sys.argv[1])), HttpHandler)
+	if os.environ.get("LISTEN_FDS") == "1":
+		# Accept connections on the socket passed down by the supervisor
+		server = HTTPServer(('', int(sys.argv[1])), HttpHandler, bind_and_activate=False)
+		server.socket = socket.fromfd(3, socket.AF_INET, socket.SOCK_STREAM)
+	else:
+		server = HTTPServer(('', int(sys.argv[1])), HttpHandler)
 	server.serve_forever()
 
 except KeyboardInterrupt:
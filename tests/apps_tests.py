@@ -0,0 +1,58 @@
+import pipes
+
+from nose.tools import istest, assert_equal, assert_raises
+
+from beach import apps
+
+
+@istest
+def template_is_rendered_with_quoted_values():
+    template = apps.compile_template("./server ${port} ${message}")
+    env = {"port": "58080", "message": "I feel fine"}
+    assert_equal("./server 58080 'I feel fine'", template.render(env, quote=pipes.quote))
+    assert_equal("./server 58080 I feel fine", template.render(env))
+
+
+@istest
+def templates_are_compiled_once():
+    assert apps.compile_template("echo ${a}") is apps.compile_template("echo ${a}")
+
+
+@istest
+def dependency_values_are_found_before_params():
+    env = apps.Environment({"port": "58080", "db.url": "param"}, {"db": {"url": "provided"}})
+    assert_equal("58080", env["port"])
+    assert_equal("provided", env["db.url"])
+    assert "db.name" not in env
+    assert_raises(KeyError, lambda: env["db.name"])
+
+
+@istest
+def dependency_names_can_contain_dots():
+    env = apps.Environment({}, {"my.db": {"url": "postgres://", "replica.url": "postgres://replica"}})
+    assert_equal("postgres://", env["my.db.url"])
+    assert_equal("postgres://replica", env["my.db.replica.url"])
+    assert "my.db.name" not in env
+
+
+@istest
+def missing_variables_include_required_params_and_variables_in_templates():
+    app_config = {
+        "require": {"port": "param"},
+        "service": "./server ${port} ${db.url}",
+        "readiness": {"type": "http", "url": "http://localhost:${port}${path}"},
+        "provides": {"url": "http://${host}:${port}"},
+    }
+    env = apps.Environment({"path": "/"}, {"db": {"url": "postgres://"}})
+    assert_equal(["host", "port"], apps.missing_variables(app_config, env))
+
+
+
+@istest
+def used_values_include_only_variables_in_templates():
+    app_config = {
+        "service": "./server ${port} ${db.url}",
+        "provides": {"url": "http://localhost:${port}"},
+    }
+    env = apps.Environment({"port": "8080", "host": "localhost"}, {"db": {"url": "postgres://", "pool_size": "4"}})
+    assert_equal({"port": "8080", "db.url": "postgres://"}, apps.used_values(app_config, env))
@@ -1,3 +1,9 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+
 from nose.tools import istest, nottest, assert_equal, assert_raises
 from nose.plugins.attrib import attr
 import funk
@@ -24,11 +30,11 @@ class BeachTests(object):
         self.supervisor = self.create_supervisor()
         self.registry = self.create_registry()
         self.add_cleanup(self.layout.close, self.supervisor.close)
-        
+    
     def teardown(self):
         while len(self._cleanup) > 0:
             self._cleanup.pop()()
-        
+    
     def deployer(self):
         return beach.Deployer(
             registry=self.registry,
@@ -43,7 +49,7 @@ class BeachTests(object):
         deployer.deploy(app_path, params={"port": "58080"})
         response = self._retry_http_get(port=58080, path="/")
         assert_equal("Hello", response.text)
-            
+    
     @istest
     def can_deploy_script_with_installation(self):
         deployer = self.deployer()
@@ -62,6 +68,14 @@ class BeachTests(object):
         response = self._retry_http_get(port=58080, path="/")
         assert_equal("I feel fine", response.text)
     
+    @istest
+    def service_is_serving_as_soon_as_deploy_returns(self):
+        deployer = self.deployer()
+        app_path = testing.example_app_path("just-a-script")
+        deployer.deploy(app_path, params={"port": "58080"})
+        response = requests.get(self.http_address(port=58080, path="/"))
+        assert_equal("Hello", response.text)
+    
     @istest
     def redeploying_restarts_service(self):
         deployer = self.deployer()
@@ -126,8 +140,8 @@ class ProductionDeploymentTests(BeachTests):
         shell = self._machine.shell()
         result = shell.run(["echo", "hello"])
         assert_equal("hello\n", result.output)
-        
-        
+    
+    
     def http_address(self, port, path):
         return "http://{0}:{1}{2}".format(
             self._machine.external_hostname(),
@@ -143,3 +157,406 @@ class ProductionDeploymentTests(BeachTests):
 class ProductionDeploymentPrecise64Tests(ProductionDeploymentTests):
     image_name = "ubuntu-precise-amd64"
 
+
+
+@istest
+def dependencies_are_resolved_once_for_all_commands():
+    registry = _CountingRegistry()
+    registry.register("message", provides={"value": "I feel fine"})
+    deployer = beach.Deployer(registry=registry, layout=None, supervisor=None)
+    app_config = {
+        "dependencies": ["message"],
+        "install": "echo ${message.value}",
+        "service": "./server.py ${port} ${message.value}",
+    }
+    env = deployer._resolve_environment({"port": "58080"}, app_config)
+    assert_equal("echo 'I feel fine'", deployer._generate_command("install", env, app_config))
+    assert_equal(
+        "./server.py 58080 'I feel fine'",
+        deployer._generate_command("service", env, app_config),
+    )
+    assert_equal(1, registry.reads)
+
+
+class _CountingRegistry(beach.registries.InMemoryRegistry):
+    reads = 0
+    
+    def find_services(self, names):
+        self.reads += 1
+        return super(_CountingRegistry, self).find_services(names)
+
+
+@istest
+def install_and_upload_are_skipped_if_release_is_already_installed():
+    layout = _FakeLayout(installed=True)
+    supervisor = _FakeSupervisor()
+    deployer = beach.Deployer(registry=None, layout=layout, supervisor=supervisor)
+    deployer.deploy(testing.example_app_path("script-with-install"), params={"port": "58080"})
+    
+    assert_equal([], layout.commands)
+    assert_equal([], layout.installed_releases)
+    assert_equal("/srv/app", supervisor.services["beach-script"])
+
+
+@istest
+def release_is_marked_as_installed_after_install_command_is_run():
+    layout = _FakeLayout(installed=False)
+    deployer = beach.Deployer(registry=None, layout=layout, supervisor=_FakeSupervisor())
+    deployer.deploy(testing.example_app_path("script-with-install"), params={"port": "58080"})
+    
+    assert_equal(["echo 'I feel fine' > message"], layout.commands)
+    assert_equal(["/srv/app"], [release.path for release in layout.installed_releases])
+
+
+@istest
+def install_is_skipped_if_install_cache_has_outputs_for_same_keys():
+    layout = _FakeLayout(installed=False)
+    deployer = beach.Deployer(registry=None, layout=layout, supervisor=_FakeSupervisor())
+    
+    with _temp_app_with_install_cache() as app_path:
+        deployer.deploy(app_path, params={})
+        deployer.deploy(app_path, params={})
+    
+    assert_equal(1, len(layout.commands))
+    assert_equal(["node_modules"], layout.restored_paths)
+    assert_equal(2, len(layout.installed_releases))
+
+
+@istest
+def releases_with_restored_install_outputs_are_saved_in_install_cache():
+    layout = _FakeLayout(installed=False)
+    deployer = beach.Deployer(registry=None, layout=layout, supervisor=_FakeSupervisor())
+    
+    with _temp_app_with_install_cache() as app_path:
+        deployer.deploy(app_path, params={})
+        deployer.deploy(app_path, params={})
+    
+    assert_equal(2, len(layout.saved_install_caches))
+
+
+@istest
+def install_is_rerun_if_install_cache_keys_change():
+    layout = _FakeLayout(installed=False)
+    deployer = beach.Deployer(registry=None, layout=layout, supervisor=_FakeSupervisor())
+    
+    with _temp_app_with_install_cache() as app_path:
+        deployer.deploy(app_path, params={})
+        with open(os.path.join(app_path, "package.json"), "w") as package_file:
+            package_file.write('{"dependencies": {"express": "4"}}')
+        deployer.deploy(app_path, params={})
+    
+    assert_equal(2, len(layout.commands))
+
+
+@istest
+def install_cache_without_paths_is_rejected():
+    deployer = beach.Deployer(registry=None, layout=_FakeLayout(installed=False), supervisor=_FakeSupervisor())
+    
+    with _temp_app_with_install_cache(paths=[]) as app_path:
+        assert_raises(ValueError, lambda: deployer.deploy(app_path, params={}))
+
+
+@istest
+def missing_params_are_reported_before_upload():
+    layout = _FakeLayout(installed=False)
+    deployer = beach.Deployer(registry=None, layout=layout, supervisor=_FakeSupervisor())
+    
+    try:
+        deployer.deploy(testing.example_app_path("script-with-install"), params={})
+        assert False, "Expected MissingVariablesError"
+    except beach.apps.MissingVariablesError as error:
+        assert_equal(["port"], error.names)
+    assert_equal([], layout.commands)
+
+
+@istest
+def app_is_left_for_layout_to_snapshot_if_no_snapshot_is_given():
+    layout = _FakeLayout(installed=True)
+    deployer = beach.Deployer(registry=None, layout=layout, supervisor=_FakeSupervisor())
+    
+    with _temp_apps({"name": "app", "service": "./app"}) as app_paths:
+        deployer.deploy(app_paths[0], params={})
+    
+    assert_equal([None], layout.snapshots)
+
+
+@istest
+def values_from_unregistered_dependencies_are_reported_as_missing():
+    layout = _FakeLayout(installed=False)
+    deployer = beach.Deployer(registry=beach.registries.InMemoryRegistry(), layout=layout, supervisor=_FakeSupervisor())
+    
+    with _temp_apps({"name": "app", "dependencies": ["message"], "service": "echo ${message.value}"}) as app_paths:
+        try:
+            deployer.deploy(app_paths[0], params={})
+            assert False, "Expected MissingVariablesError"
+        except beach.apps.MissingVariablesError as error:
+            assert_equal(["message.value"], error.names)
+    assert_equal([], layout.commands)
+
+
+@istest
+def provides_are_registered_under_app_name_after_deploy():
+    registry = beach.registries.InMemoryRegistry()
+    deployer = beach.Deployer(registry=registry, layout=_FakeLayout(installed=True), supervisor=_FakeSupervisor())
+    
+    app_path = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(app_path, "beach.json"), "w") as config_file:
+            json.dump({
+                "name": "web",
+                "service": "./server ${port}",
+                "provides": {"url": "http://localhost:${port}"},
+            }, config_file)
+        deployer.deploy(app_path, params={"port": "58080"})
+    finally:
+        shutil.rmtree(app_path)
+    
+    assert_equal({"url": "http://localhost:58080"}, registry.find_service("web").provides)
+
+
+@istest
+def provides_are_not_registered_if_deployer_has_no_registry():
+    supervisor = _FakeSupervisor()
+    deployer = beach.Deployer(registry=None, layout=_FakeLayout(installed=True), supervisor=supervisor)
+    
+    with _temp_apps({"name": "web", "service": "./server", "provides": {"url": "http://localhost"}}) as app_paths:
+        deployer.deploy(app_paths[0], params={})
+    
+    assert_equal("./server", supervisor.commands["beach-web"])
+
+
+@istest
+def only_dependents_of_changed_services_are_set_up_again_in_one_batch():
+    registry = beach.registries.InMemoryRegistry()
+    registry.register("db", provides={"url": "db-1"})
+    registry.register("cache", provides={"url": "cache-1"})
+    supervisor = _FakeSupervisor()
+    deployer = beach.Deployer(registry=registry, layout=_FakeLayout(installed=True), supervisor=supervisor)
+    
+    with _temp_apps(
+        {"name": "web", "dependencies": ["db"], "service": "./web ${db.url}"},
+        {"name": "worker", "dependencies": ["db", "cache"], "service": "./worker ${db.url} ${cache.url}"},
+        {"name": "cron", "dependencies": ["cache"], "service": "./cron ${cache.url}"},
+    ) as app_paths:
+        for app_path in app_paths:
+            deployer.deploy(app_path, params={})
+        
+        registry.register("db", provides={"url": "db-2"})
+        updated_names = deployer.update_dependents()
+    
+    assert_equal(["web", "worker"], sorted(updated_names))
+    assert_equal([["beach-web", "beach-worker"]], [sorted(batch) for batch in supervisor.batches])
+    assert_equal("./web db-2", supervisor.commands["beach-web"])
+    assert_equal("./worker db-2 cache-1", supervisor.commands["beach-worker"])
+    assert_equal([], deployer.update_dependents())
+
+
+@istest
+def dependents_are_left_alone_if_only_values_they_do_not_use_change():
+    registry = beach.registries.InMemoryRegistry()
+    registry.register("db", provides={"url": "db-1", "pool_size": "4"})
+    supervisor = _FakeSupervisor()
+    deployer = beach.Deployer(registry=registry, layout=_FakeLayout(installed=True), supervisor=supervisor)
+    
+    with _temp_apps({"name": "web", "dependencies": ["db"], "service": "./web ${db.url}"}) as app_paths:
+        deployer.deploy(app_paths[0], params={})
+        registry.register("db", provides={"url": "db-1", "pool_size": "8"})
+        assert_equal([], deployer.update_dependents())
+    
+    assert_equal([], supervisor.batches)
+
+
+@istest
+def dependents_are_redeployed_if_their_install_command_changes():
+    registry = beach.registries.InMemoryRegistry()
+    registry.register("message", provides={"value": "one"})
+    layout = _FakeLayout(installed=False)
+    supervisor = _FakeSupervisor()
+    deployer = beach.Deployer(registry=registry, layout=layout, supervisor=supervisor)
+    
+    with _temp_apps(
+        {"name": "app", "dependencies": ["message"], "install": "echo ${message.value}", "service": "./app"},
+    ) as app_paths:
+        deployer.deploy(app_paths[0], params={})
+        registry.register("message", provides={"value": "two"})
+        assert_equal(["app"], deployer.update_dependents())
+    
+    assert_equal(["echo one", "echo two"], layout.commands)
+    assert_equal([], supervisor.batches)
+
+
+@istest
+def dependents_are_left_alone_if_dependency_is_deregistered():
+    registry = beach.registries.InMemoryRegistry()
+    registry.register("db", provides={"url": "db-1"})
+    supervisor = _FakeSupervisor()
+    deployer = beach.Deployer(registry=registry, layout=_FakeLayout(installed=True), supervisor=supervisor)
+    
+    with _temp_apps({"name": "web", "dependencies": ["db"], "service": "./web ${db.url}"}) as app_paths:
+        deployer.deploy(app_paths[0], params={})
+        registry.deregister("db")
+        assert_equal([], deployer.update_dependents())
+    
+    assert_equal("./web db-1", supervisor.commands["beach-web"])
+
+
+@istest
+def supervisor_is_installed_while_release_is_uploaded():
+    uploading = threading.Event()
+    installed = threading.Event()
+    
+    class OverlappingLayout(_FakeLayout):
+        def upload_service(self, *args, **kwargs):
+            uploading.set()
+            installed.wait(5)
+            assert installed.is_set()
+            return super(OverlappingLayout, self).upload_service(*args, **kwargs)
+    
+    class OverlappingSupervisor(_FakeSupervisor):
+        def install(self):
+            uploading.wait(5)
+            assert uploading.is_set()
+            installed.set()
+    
+    supervisor = OverlappingSupervisor()
+    deployer = beach.Deployer(registry=None, layout=OverlappingLayout(installed=True), supervisor=supervisor)
+    deployer.deploy(testing.example_app_path("script-with-install"), params={"port": "58080"})
+    
+    assert_equal("/srv/app", supervisor.services["beach-script"])
+
+
+@istest
+def old_releases_are_kept_if_service_cannot_be_set_up():
+    class FailingSupervisor(_FakeSupervisor):
+        def set_up(self, *args, **kwargs):
+            raise Exception("Could not set up")
+    
+    layout = _FakeLayout(installed=True)
+    deployer = beach.Deployer(registry=None, layout=layout, supervisor=FailingSupervisor())
+    assert_raises(Exception, lambda: deployer.deploy(testing.example_app_path("script-with-install"), params={"port": "58080"}))
+    
+    assert_equal([], layout.removed_old_releases)
+
+
+@istest
+def old_releases_are_removed_after_deploy():
+    layout = _FakeLayout(installed=True)
+    deployer = beach.Deployer(registry=None, layout=layout, supervisor=_FakeSupervisor())
+    deployer.deploy(testing.example_app_path("script-with-install"), params={"port": "58080"})
+    
+    assert_equal(["/srv/app"], [release.path for release in layout.removed_old_releases])
+
+
+@istest
+def deploy_can_overlap_steps_on_one_pooled_local_shell():
+    with beach.shells.ShellPool() as shells:
+        with tempfile.NamedTemporaryFile() as registry_file:
+            registry = beach.registries.FileRegistry(shells.shell({}), registry_file.name)
+            registry.register("message", provides={"value": "Sailing to Philadelphia"})
+            with beach.layouts.TemporaryLayout() as layout:
+                with beach.supervisors.stop_on_exit() as supervisor:
+                    deployer = beach.Deployer(registry=registry, layout=layout, supervisor=supervisor)
+                    deployer.deploy(testing.example_app_path("script-with-dependency"), params={"port": "58083"})
+                    
+                    response = testing.retry_http_get("http://localhost:58083", timeout=1)
+                    assert_equal("Sailing to Philadelphia", response.text)
+
+
+class _temp_apps(object):
+    def __init__(self, *app_configs):
+        self._app_configs = app_configs
+    
+    def __enter__(self):
+        self._path = tempfile.mkdtemp()
+        app_paths = []
+        for app_config in self._app_configs:
+            app_path = os.path.join(self._path, app_config["name"])
+            os.mkdir(app_path)
+            with open(os.path.join(app_path, "beach.json"), "w") as config_file:
+                json.dump(app_config, config_file)
+            app_paths.append(app_path)
+        return app_paths
+    
+    def __exit__(self, *args):
+        shutil.rmtree(self._path)
+
+
+class _temp_app_with_install_cache(object):
+    def __init__(self, paths=None):
+        if paths is None:
+            paths = ["node_modules"]
+        self._paths = paths
+    
+    def __enter__(self):
+        self._path = tempfile.mkdtemp()
+        with open(os.path.join(self._path, "beach.json"), "w") as config_file:
+            json.dump({
+                "name": "app",
+                "install": "npm install",
+                "install_cache": {"keys": ["package.json"], "paths": self._paths},
+                "service": "node app.js",
+            }, config_file)
+        with open(os.path.join(self._path, "package.json"), "w") as package_file:
+            package_file.write('{"dependencies": {"express": "3"}}')
+        return self._path
+    
+    def __exit__(self, *args):
+        shutil.rmtree(self._path)
+
+
+class _FakeLayout(object):
+    def __init__(self, installed):
+        self._installed = installed
+        self._install_cache = set()
+        self.commands = []
+        self.installed_releases = []
+        self.restored_paths = []
+        self.removed_old_releases = []
+        self.snapshots = []
+        self.saved_install_caches = []
+    
+    def restore_install_cache(self, release, key, paths):
+        if key in self._install_cache:
+            self.restored_paths += paths
+            return True
+        else:
+            return False
+    
+    def save_install_cache(self, release, key):
+        self._install_cache.add(key)
+        self.saved_install_caches.append(key)
+    
+    def upload_service(self, service_name, path, snapshot=None, install_command=None):
+        self.snapshots.append(snapshot)
+        return beach.layouts.Release("/srv/app", username=None, installed=self._installed)
+    
+    def run(self, command, cwd):
+        self.commands.append(command[-1])
+    
+    def mark_installed(self, release):
+        self.installed_releases.append(release)
+    
+    def activate(self, release):
+        return release.path
+    
+    def remove_old_releases(self, release):
+        self.removed_old_releases.append(release)
+
+
+class _FakeSupervisor(object):
+    def __init__(self):
+        self.services = {}
+        self.commands = {}
+        self.batches = []
+    
+    def install(self):
+        pass
+    
+    def set_up(self, service_name, cwd, username, command, reload_signal=None, listen_port=None):
+        self.services[service_name] = cwd
+        self.commands[service_name] = command
+    
+    def set_up_many(self, services):
+        self.batches.append([service["service_name"] for service in services])
+        for service in services:
+            self.set_up(**service)
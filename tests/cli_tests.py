@@ -61,6 +61,21 @@ def can_deploy_temporarily_using_cli_with_params_passed_on_command_line():
         process.wait_for_result()
     
 
+@istest
+def watching_is_rejected_when_deploying_to_several_targets():
+    app_path = testing.example_app_path("just-a-script")
+    config = {"targets": [{}, {}]}
+    
+    with tempfile.NamedTemporaryFile() as config_file:
+        json.dump(config, config_file)
+        config_file.flush()
+        
+        result = _local.run(["beach", "deploy", app_path, "-c", config_file.name, "--watch"], allow_error=True)
+    
+    assert_equal(1, result.return_code)
+    assert_equal(b"--watch can't be used with several targets\n", result.stderr_output.splitlines(True)[-1])
+
+
 @istest
 def can_register_services_using_cli():
     with tempfile.NamedTemporaryFile() as registry_file:
@@ -0,0 +1,82 @@
+import threading
+import time
+
+from nose.tools import istest, assert_equal
+
+from beach import fleets
+from . import testing
+
+
+@istest
+def results_are_reported_for_each_target_in_order():
+    targets = [
+        ("first", _FakeDeployer()),
+        ("second", _FakeDeployer(error=ValueError("Could not connect"))),
+        ("third", _FakeDeployer()),
+    ]
+    results = _deploy(targets, max_workers=2)
+    
+    assert_equal(["first", "second", "third"], [result.name for result in results])
+    assert_equal([True, False, True], [result.succeeded for result in results])
+    assert_equal("Could not connect", str(results[1].error))
+
+
+@istest
+def app_is_hashed_once_for_all_targets():
+    deployers = [_FakeDeployer() for _ in range(3)]
+    _deploy([(str(index), deployer) for index, deployer in enumerate(deployers)], max_workers=3)
+    
+    snapshots = [deployer.snapshot for deployer in deployers]
+    assert snapshots[0] is not None
+    assert all(snapshot is snapshots[0] for snapshot in snapshots)
+
+
+@istest
+def targets_are_deployed_concurrently_up_to_limit():
+    running = _Counter()
+    deployers = [_FakeDeployer(running=running, duration=0.1) for _ in range(6)]
+    start_time = time.time()
+    _deploy([(str(index), deployer) for index, deployer in enumerate(deployers)], max_workers=3)
+    
+    assert_equal(3, running.peak)
+    assert time.time() - start_time < 0.5
+
+
+def _deploy(targets, max_workers):
+    return fleets.deploy(
+        targets,
+        testing.example_app_path("just-a-script"),
+        params={},
+        max_workers=max_workers,
+    )
+
+
+class _FakeDeployer(object):
+    def __init__(self, error=None, running=None, duration=0):
+        self._error = error
+        self._running = running or _Counter()
+        self._duration = duration
+        self.snapshot = None
+    
+    def deploy(self, path, params, snapshot):
+        self.snapshot = snapshot
+        with self._running:
+            time.sleep(self._duration)
+        if self._error is not None:
+            raise self._error
+
+
+class _Counter(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+        self.peak = 0
+    
+    def __enter__(self):
+        with self._lock:
+            self._value += 1
+            self.peak = max(self.peak, self._value)
+    
+    def __exit__(self, *args):
+        with self._lock:
+            self._value -= 1
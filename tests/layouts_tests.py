@@ -0,0 +1,208 @@
+import fcntl
+import os
+import tempfile
+import shutil
+import time
+
+import spur
+from nose.tools import istest, assert_equal
+
+from beach import layouts
+
+
+@istest
+class ReleaseManifestTests(object):
+    def setup(self):
+        self._dir_path = tempfile.mkdtemp()
+        self.manifest = layouts.ReleaseManifest(
+            spur.LocalShell(),
+            os.path.join(self._dir_path, ".beach", "releases"),
+        )
+    
+    def teardown(self):
+        shutil.rmtree(self._dir_path)
+    
+    @istest
+    def release_is_not_found_if_manifest_does_not_exist(self):
+        assert_equal(None, self.manifest.find("abc"))
+    
+    @istest
+    def can_find_release_after_adding_it(self):
+        release_path = self._create_release_dir("1-abc")
+        self.manifest.add("abc", release_path)
+        assert_equal(release_path, self.manifest.find("abc"))
+    
+    @istest
+    def release_is_not_found_if_its_directory_has_been_removed(self):
+        release_path = self._create_release_dir("1-abc")
+        self.manifest.add("abc", release_path)
+        shutil.rmtree(release_path)
+        assert_equal(None, self.manifest.find("abc"))
+    
+    @istest
+    def most_recent_release_with_key_is_found(self):
+        self.manifest.add("abc", self._create_release_dir("1-abc"))
+        self.manifest.add("def", self._create_release_dir("2-def"))
+        self.manifest.add("abc", self._create_release_dir("3 abc"))
+        assert_equal(os.path.join(self._dir_path, "3 abc"), self.manifest.find("abc"))
+    
+    def _create_release_dir(self, name):
+        path = os.path.join(self._dir_path, name)
+        os.mkdir(path)
+        return path
+
+
+@istest
+def activating_release_points_current_symlink_at_it():
+    dir_path = tempfile.mkdtemp()
+    try:
+        layout = layouts.UserPerService(spur.LocalShell())
+        for name in ["1-abc", "2-def"]:
+            os.mkdir(os.path.join(dir_path, name))
+            current_path = layout.activate(layouts.Release(os.path.join(dir_path, name), username="app"))
+            
+            assert_equal(os.path.join(dir_path, "current"), current_path)
+            assert_equal(os.path.join(dir_path, name), os.readlink(current_path))
+        assert_equal(["1-abc", "2-def", "current"], sorted(os.listdir(dir_path)))
+    finally:
+        shutil.rmtree(dir_path)
+
+
+@istest
+class InstallCacheTests(object):
+    def setup(self):
+        self._home_path = tempfile.mkdtemp()
+        self._layout = layouts.UserPerService(spur.LocalShell())
+        self._cached_release = self._create_release("1-abc")
+        self._release = self._create_release("2-def")
+    
+    def teardown(self):
+        shutil.rmtree(self._home_path)
+    
+    @istest
+    def outputs_are_linked_from_cached_release(self):
+        self._write(self._cached_release, "node_modules/express/index.js", "module.exports = {};")
+        self._layout.save_install_cache(self._cached_release, "abc")
+        
+        assert self._layout.restore_install_cache(self._release, "abc", ["node_modules"])
+        output_path = os.path.join(self._release.path, "node_modules/express/index.js")
+        with open(output_path) as output_file:
+            assert_equal("module.exports = {};", output_file.read())
+    
+    @istest
+    def outputs_are_not_restored_if_cache_key_is_unknown(self):
+        self._write(self._cached_release, "node_modules/express/index.js", "module.exports = {};")
+        self._layout.save_install_cache(self._cached_release, "abc")
+        
+        assert not self._layout.restore_install_cache(self._release, "def", ["node_modules"])
+    
+    @istest
+    def outputs_containing_path_of_cached_release_are_not_restored(self):
+        python_path = os.path.join(self._cached_release.path, "venv/bin/python")
+        self._write(self._cached_release, "venv/bin/python", "")
+        self._write(self._cached_release, "venv/bin/app", "#!{0}\n".format(python_path))
+        self._layout.save_install_cache(self._cached_release, "abc")
+        
+        assert not self._layout.restore_install_cache(self._release, "abc", ["venv"])
+        assert not os.path.exists(os.path.join(self._release.path, "venv"))
+    
+    @istest
+    def outputs_linking_into_cached_release_are_not_restored(self):
+        self._write(self._cached_release, "venv/lib/site.py", "")
+        os.symlink(
+            os.path.join(self._cached_release.path, "venv/lib"),
+            os.path.join(self._cached_release.path, "venv/lib64"),
+        )
+        self._layout.save_install_cache(self._cached_release, "abc")
+        
+        assert not self._layout.restore_install_cache(self._release, "abc", ["venv"])
+    
+    def _create_release(self, name):
+        path = os.path.join(self._home_path, name)
+        os.mkdir(path)
+        return layouts.Release(path, username="app")
+    
+    def _write(self, release, relative_path, contents):
+        path = os.path.join(release.path, relative_path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as output_file:
+            output_file.write(contents)
+
+
+@istest
+class RetentionTests(object):
+    def setup(self):
+        self._home_path = tempfile.mkdtemp()
+    
+    def teardown(self):
+        shutil.rmtree(self._home_path)
+    
+    @istest
+    def newest_releases_are_kept(self):
+        now = int(time.time())
+        for index in range(4):
+            self._create_release_dir("{0}-abc{1}".format(now - index, index))
+        
+        removed = self._apply(layouts.Retention(keep=2))
+        
+        assert_equal(["{0}-abc1".format(now - 1), "{0}-abc0".format(now)], self._release_names())
+        assert_equal(2, len(removed))
+    
+    @istest
+    def releases_younger_than_max_age_are_kept(self):
+        now = int(time.time())
+        self._create_release_dir("{0}-abc".format(now - 100))
+        self._create_release_dir("{0}-def".format(now - 10000))
+        
+        self._apply(layouts.Retention(max_age=1000))
+        
+        assert_equal(["{0}-abc".format(now - 100)], self._release_names())
+    
+    @istest
+    def live_release_is_never_removed(self):
+        old_release_path = self._create_release_dir("1-abc")
+        self._create_release_dir("2-def")
+        os.symlink(old_release_path, os.path.join(self._home_path, "current"))
+        
+        self._apply(layouts.Retention(keep=1))
+        
+        assert_equal(["1-abc", "2-def", "current"], self._release_names())
+    
+    @istest
+    def removed_releases_are_dropped_from_manifests(self):
+        manifest = layouts.ReleaseManifest(spur.LocalShell(), os.path.join(self._home_path, ".beach", "releases"))
+        manifest.add("abc", self._create_release_dir("1-abc"))
+        manifest.add("def", self._create_release_dir("2-def"))
+        
+        self._apply(layouts.Retention(keep=1))
+        
+        with open(os.path.join(self._home_path, ".beach", "releases")) as manifest_file:
+            assert_equal(["def"], [line.split()[0] for line in manifest_file])
+    
+    @istest
+    def objects_are_left_while_store_is_locked_by_upload(self):
+        objects_path = os.path.join(self._home_path, ".beach", "objects")
+        partial_path = os.path.join(objects_path, ".partial-abc")
+        os.makedirs(partial_path)
+        two_hours_ago = time.time() - 2 * 60 * 60
+        os.utime(partial_path, (two_hours_ago, two_hours_ago))
+        
+        with open(os.path.join(self._home_path, ".beach", "objects.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+            self._apply(layouts.Retention(keep=1))
+            assert os.path.exists(partial_path)
+        
+        self._apply(layouts.Retention(keep=1))
+        assert not os.path.exists(partial_path)
+    
+    def _apply(self, retention):
+        return retention.apply(spur.LocalShell(), [self._home_path])
+    
+    def _create_release_dir(self, name):
+        path = os.path.join(self._home_path, name)
+        os.mkdir(path)
+        return path
+    
+    def _release_names(self):
+        return sorted(name for name in os.listdir(self._home_path) if not name.startswith("."))
@@ -0,0 +1,54 @@
+import os
+import socket
+import threading
+import time
+
+import spur
+from nose.tools import istest, assert_raises
+
+from beach import readiness
+
+
+_local = spur.LocalShell()
+
+
+@istest
+def tcp_probe_passes_once_port_is_listening():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    port = listener.getsockname()[1]
+    threading.Timer(0.2, lambda: listener.listen(1)).start()
+    try:
+        probe = readiness.read_probe({"type": "tcp", "port": "${port}", "timeout": 5}, {"port": str(port)})
+        _wait_until_ready(probe)
+    finally:
+        listener.close()
+
+
+@istest
+def command_probe_is_run_in_app_directory():
+    probe = readiness.read_probe({"type": "command", "command": "test -f readiness_tests.py", "timeout": 5}, {})
+    _wait_until_ready(probe, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+@istest
+def error_is_raised_if_probe_does_not_pass_before_timeout():
+    probe = readiness.read_probe({"type": "command", "command": "false", "timeout": 1}, {})
+    start_time = time.time()
+    assert_raises(readiness.NotReadyError, lambda: _wait_until_ready(probe))
+    assert time.time() - start_time < 3
+
+
+@istest
+def http_probe_fails_if_nothing_is_serving():
+    probe = readiness.read_probe({"type": "http", "url": "http://localhost:${port}/", "timeout": 0}, {"port": "58083"})
+    assert_raises(readiness.NotReadyError, lambda: _wait_until_ready(probe))
+
+
+@istest
+def error_is_raised_for_unrecognised_probe_type():
+    assert_raises(ValueError, lambda: readiness.read_probe({"type": "udp"}, {}))
+
+
+def _wait_until_ready(probe, cwd="/"):
+    readiness.wait_until_ready(_local.run, "beach-app", probe, cwd=cwd)
@@ -1,11 +1,13 @@
 import tempfile
 import shutil
 import os
+import threading
+import time
 
 import spur
-from nose.tools import istest, nottest, assert_equal
+from nose.tools import istest, nottest, assert_equal, assert_raises
 
-from beach import registries
+from beach import registries, registry_server
 
 
 @nottest
@@ -32,6 +34,22 @@ class RegistryTests(object):
         assert self.registry.find_service("node-0.10") is not None 
         self.registry.deregister("node-0.10")
         assert self.registry.find_service("node-0.10") is None
+    
+    @istest
+    def version_changes_after_registration(self):
+        self.registry.register("node-0.10", provides={})
+        version = self.registry.version()
+        self.registry.register("node-0.8", provides={})
+        assert version != self.registry.version()
+    
+    @istest
+    def can_find_many_services_at_once(self):
+        self.registry.register("node-0.10", provides={"version": "0.10.2"})
+        self.registry.register("node-0.8", provides={"version": "0.8.26"})
+        services = self.registry.find_services(["node-0.10", "node-0.8", "node-0.6"])
+        assert_equal({"version": "0.10.2"}, services["node-0.10"].provides)
+        assert_equal({"version": "0.8.26"}, services["node-0.8"].provides)
+        assert_equal(None, services["node-0.6"])
 
 
 @istest
@@ -59,6 +77,170 @@ class FileRegistryTests(RegistryTests):
         except ValueError as error:
             assert_equal("Registry file was not valid JSON", str(error))
     
+@istest
+class HttpRegistryTests(RegistryTests):
+    def setup(self):
+        self._server = registry_server.RegistryServer().start()
+        self.registry = registries.HttpRegistry(self._server.url)
+    
+    def teardown(self):
+        self.registry.close()
+        self._server.close()
+    
+    @istest
+    def deregistering_missing_service_raises_key_error(self):
+        assert_raises(KeyError, lambda: self.registry.deregister("node-0.10"))
+    
+    @istest
+    def watch_returns_once_registry_changes(self):
+        version = self.registry.version()
+        timer = threading.Timer(0.1, lambda: registries.HttpRegistry(self._server.url).register("node-0.10", provides={}))
+        timer.start()
+        
+        start_time = time.time()
+        new_version = self.registry.watch(version, timeout=5)
+        
+        assert new_version != version
+        assert time.time() - start_time < 2
+        timer.join()
+    
+    @istest
+    def watch_returns_same_version_after_timeout_if_unchanged(self):
+        version = self.registry.version()
+        assert_equal(version, self.registry.watch(version, timeout=0.1))
+
+
+@istest
+def registry_server_persists_services_to_file():
+    dir_path = tempfile.mkdtemp()
+    try:
+        path = os.path.join(dir_path, "registry.json")
+        with registry_server.RegistryServer(path=path).start() as server:
+            registries.HttpRegistry(server.url).register("node-0.10", provides={"version": "0.10.2"})
+        
+        with registry_server.RegistryServer(path=path).start() as server:
+            registry = registries.HttpRegistry(server.url)
+            assert_equal({"version": "0.10.2"}, registry.find_service("node-0.10").provides)
+    finally:
+        shutil.rmtree(dir_path)
+
+
+@istest
+class CachingRegistryTests(RegistryTests):
+    def setup(self):
+        self._registry_file = tempfile.NamedTemporaryFile("w")
+        self._shell = _CountingShell(spur.LocalShell())
+        self._file_registry = registries.FileRegistry(self._shell, self._registry_file.name)
+        self.registry = registries.CachingRegistry(self._file_registry)
+    
+    def teardown(self):
+        self._registry_file.close()
+    
+    @istest
+    def registry_file_is_not_reread_if_unchanged(self):
+        self.registry.register("node-0.10", provides={"version": "0.10.2"})
+        self.registry.find_service("node-0.10")
+        self._shell.opened = 0
+        
+        assert_equal({"version": "0.10.2"}, self.registry.find_service("node-0.10").provides)
+        assert_equal(0, self._shell.opened)
+    
+    @istest
+    def changes_by_other_writers_are_seen(self):
+        self.registry.register("node-0.10", provides={"version": "0.10.2"})
+        self.registry.find_service("node-0.10")
+        
+        self._file_registry.register("node-0.10", provides={"version": "0.10.3"})
+        
+        assert_equal({"version": "0.10.3"}, self.registry.find_service("node-0.10").provides)
+
+
+class _CountingShell(object):
+    def __init__(self, shell):
+        self._shell = shell
+        self.opened = 0
+    
+    def run(self, *args, **kwargs):
+        return self._shell.run(*args, **kwargs)
+    
+    def open(self, *args, **kwargs):
+        self.opened += 1
+        return self._shell.open(*args, **kwargs)
+
+
+@istest
+class SqliteRegistryTests(RegistryTests):
+    def setup(self):
+        self._dir_path = tempfile.mkdtemp()
+        self.registry = registries.SqliteRegistry(os.path.join(self._dir_path, "registry.sqlite"))
+    
+    def teardown(self):
+        self.registry.close()
+        shutil.rmtree(self._dir_path)
+    
+    @istest
+    def cached_lookups_in_any_thread_see_writes_from_other_processes(self):
+        registry = registries.CachingRegistry(self.registry)
+        other_registry = registries.SqliteRegistry(os.path.join(self._dir_path, "registry.sqlite"))
+        try:
+            other_registry.register("db", provides={"url": "one"})
+            assert_equal({"url": "one"}, _in_thread(lambda: registry.find_service("db")).provides)
+            other_registry.register("db", provides={"url": "two"})
+            assert_equal({"url": "two"}, _in_thread(lambda: registry.find_service("db")).provides)
+        finally:
+            other_registry.close()
+    
+    @istest
+    def closing_closes_connections_of_every_thread(self):
+        registered = threading.Event()
+        closed = threading.Event()
+        
+        def register():
+            self.registry.register("web", provides={})
+            registered.set()
+            closed.wait()
+        
+        thread = threading.Thread(target=register)
+        thread.start()
+        try:
+            registered.wait()
+            self.registry.find_service("web")
+            self.registry.close()
+            # The write-ahead log is removed when the last connection closes
+            assert not os.path.exists(os.path.join(self._dir_path, "registry.sqlite-wal"))
+        finally:
+            closed.set()
+            thread.join()
+    
+    @istest
+    def concurrent_registrations_are_not_lost(self):
+        path = os.path.join(self._dir_path, "registry.sqlite")
+        
+        def register_services(writer_index):
+            registry = registries.SqliteRegistry(path)
+            for service_index in range(20):
+                name = "service-{0}-{1}".format(writer_index, service_index)
+                registry.register(name, provides={})
+            registry.close()
+        
+        threads = [
+            threading.Thread(target=register_services, args=(writer_index, ))
+            for writer_index in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        names = [
+            "service-{0}-{1}".format(writer_index, service_index)
+            for writer_index in range(4)
+            for service_index in range(20)
+        ]
+        services = self.registry.find_services(names)
+        assert all(service is not None for service in services.values())
+
+
 @istest
 def file_registry_creates_file_if_it_doesnt_already_exist_when_registering():
     dir_path = tempfile.mkdtemp()
@@ -70,3 +252,11 @@ def file_registry_creates_file_if_it_doesnt_already_exist_when_registering():
         assert_equal(provides, registry.find_service("node-0.10").provides)
     finally:
         shutil.rmtree(dir_path)
+
+
+def _in_thread(func):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(func()))
+    thread.start()
+    thread.join()
+    return results[0]
@@ -0,0 +1,94 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from nose.tools import istest, assert_equal
+
+from beach import shells
+
+
+@istest
+def pool_hands_out_same_shell_for_same_host():
+    with shells.ShellPool() as pool:
+        first = pool.shell({"protocol": "ssh", "hostname": "example.com", "layout": "user-per-service"})
+        second = pool.shell({"protocol": "ssh", "hostname": "example.com", "supervisor": "runit"})
+        assert first is second
+
+
+@istest
+def pool_hands_out_different_shells_for_different_hosts():
+    with shells.ShellPool() as pool:
+        first = pool.shell({"protocol": "ssh", "hostname": "example.com"})
+        second = pool.shell({"protocol": "ssh", "hostname": "example.net"})
+        assert first is not second
+
+
+@istest
+def closing_pool_forgets_shells():
+    pool = shells.ShellPool()
+    first = pool.shell({})
+    pool.close()
+    assert pool.shell({}) is not first
+
+
+@istest
+def error_if_protocol_is_not_recognised():
+    try:
+        shells.create_shell({"protocol": "telnet"})
+        assert False, "Expected ValueError"
+    except ValueError as error:
+        assert_equal("Unrecognised protocol: telnet", str(error))
+
+
+@istest
+def local_shell_opens_files_without_importing_spur():
+    # Run in a new interpreter since this one has already imported spur
+    code = "\n".join([
+        "import sys, tempfile",
+        "import beach",
+        "with tempfile.NamedTemporaryFile() as temp_file:",
+        "    with beach.shells.create_shell({}).open(temp_file.name, 'w') as shell_file:",
+        "        shell_file.write('hello')",
+        "    assert open(temp_file.name).read() == 'hello'",
+        "assert 'spur' not in sys.modules, 'spur was imported'",
+    ])
+    env = os.environ.copy()
+    env["PYTHONPATH"] = os.path.join(os.path.dirname(__file__), "..")
+    subprocess.check_call([sys.executable, "-c", code], env=env)
+
+
+@istest
+def pooled_shell_opens_one_connection_when_first_used_by_many_threads():
+    connections = []
+    
+    class LazilyConnectingShell(object):
+        # Like spur.SshShell, connects on first use without a lock
+        _connection = None
+        
+        def run(self, command):
+            if self._connection is None:
+                time.sleep(0.1)
+                self._connection = object()
+                connections.append(self._connection)
+        
+        def close(self):
+            pass
+    
+    original_create_shell = shells.create_shell
+    shells.create_shell = lambda target: LazilyConnectingShell()
+    try:
+        with shells.ShellPool() as pool:
+            threads = [
+                threading.Thread(target=lambda: pool.shell({"protocol": "ssh", "hostname": "example.com"}).run(["true"]))
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+    finally:
+        shells.create_shell = original_create_shell
+    
+    assert_equal(1, len(connections))
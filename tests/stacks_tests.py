@@ -0,0 +1,107 @@
+import os
+import json
+import tempfile
+import shutil
+import threading
+import time
+
+from nose.tools import istest, assert_equal, assert_raises
+
+from beach import stacks
+
+
+@istest
+def apps_are_deployed_after_the_apps_they_depend_on():
+    with _temp_stack({"db": [], "api": ["db"], "web": ["api"]}) as paths:
+        deployer = _FakeDeployer()
+        results = stacks.deploy(deployer, [paths["web"], paths["api"], paths["db"]], params={}, max_workers=3)
+    
+    assert_equal(["web", "api", "db"], [result.name for result in results])
+    assert all(result.succeeded for result in results)
+    assert_equal(["db", "api", "web"], deployer.deployed)
+
+
+@istest
+def independent_apps_are_deployed_concurrently():
+    with _temp_stack({"db": [], "cache": [], "api": ["db", "cache"]}) as paths:
+        deployer = _FakeDeployer(duration=0.1)
+        stacks.deploy(deployer, [paths["db"], paths["cache"], paths["api"]], params={}, max_workers=2)
+    
+    assert_equal(2, deployer.peak)
+    assert_equal("api", deployer.deployed[-1])
+
+
+@istest
+def dependencies_outside_of_stack_are_ignored_when_scheduling():
+    with _temp_stack({"api": ["db"]}) as paths:
+        deployer = _FakeDeployer()
+        results = stacks.deploy(deployer, [paths["api"]], params={}, max_workers=1)
+    
+    assert results[0].succeeded
+
+
+@istest
+def apps_depending_on_failed_app_are_skipped():
+    with _temp_stack({"db": [], "api": ["db"], "web": ["api"], "cache": []}) as paths:
+        deployer = _FakeDeployer(failing=["db"])
+        results = stacks.deploy(
+            deployer,
+            [paths["db"], paths["api"], paths["web"], paths["cache"]],
+            params={},
+            max_workers=2,
+        )
+    
+    assert_equal([False, False, False, True], [result.succeeded for result in results])
+    assert_equal("db", results[1].error.dependency_name)
+    assert_equal("api", results[2].error.dependency_name)
+    assert_equal(["cache"], deployer.deployed)
+
+
+@istest
+def dependency_cycles_are_rejected_before_deploying():
+    with _temp_stack({"a": ["b"], "b": ["a"], "c": []}) as paths:
+        deployer = _FakeDeployer()
+        assert_raises(ValueError, lambda: stacks.deploy(deployer, list(paths.values()), params={}, max_workers=1))
+    
+    assert_equal([], deployer.deployed)
+
+
+class _temp_stack(object):
+    def __init__(self, dependencies):
+        self._dependencies = dependencies
+    
+    def __enter__(self):
+        self._path = tempfile.mkdtemp()
+        paths = {}
+        for name, dependencies in self._dependencies.items():
+            app_path = os.path.join(self._path, name)
+            os.mkdir(app_path)
+            with open(os.path.join(app_path, "beach.json"), "w") as config_file:
+                json.dump({"name": name, "dependencies": dependencies}, config_file)
+            paths[name] = app_path
+        return paths
+    
+    def __exit__(self, *args):
+        shutil.rmtree(self._path)
+
+
+class _FakeDeployer(object):
+    def __init__(self, failing=(), duration=0):
+        self._failing = failing
+        self._duration = duration
+        self._lock = threading.Lock()
+        self._running = 0
+        self.peak = 0
+        self.deployed = []
+    
+    def deploy(self, path, params):
+        name = os.path.basename(path)
+        with self._lock:
+            self._running += 1
+            self.peak = max(self.peak, self._running)
+        time.sleep(self._duration)
+        with self._lock:
+            self._running -= 1
+            if name in self._failing:
+                raise ValueError("Could not deploy {0}".format(name))
+            self.deployed.append(name)
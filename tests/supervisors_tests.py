@@ -0,0 +1,294 @@
+import os
+import tempfile
+import shutil
+import socket
+import threading
+import time
+
+import spur
+from nose.tools import istest, assert_equal
+
+from beach import supervisors
+
+
+@istest
+class SupervisorTests(object):
+    def setup(self):
+        self._dir_path = tempfile.mkdtemp()
+        self._output_dir = os.path.join(self._dir_path, "output")
+        os.mkdir(self._output_dir)
+        self._shell = _CountingShell(spur.LocalShell())
+        self.supervisor = self._create_supervisor(
+            "scripts",
+            create_service='echo "${{command}}" > "{0}/${{service_name}}"',
+        )
+    
+    def teardown(self):
+        shutil.rmtree(self._dir_path)
+    
+    @istest
+    def many_services_are_set_up_with_one_remote_command(self):
+        self.supervisor.set_up_many([
+            {"service_name": "first", "cwd": "/srv/first", "username": "first", "command": "./first"},
+            {"service_name": "second", "cwd": "/srv/second", "username": "second", "command": "./second"},
+        ])
+        
+        assert_equal(1, self._shell.commands)
+        assert "exec ./first" in self._read_output("first")
+        assert "exec ./second" in self._read_output("second")
+    
+    @istest
+    def reload_signal_is_passed_to_create_service_script(self):
+        supervisor = self._create_supervisor(
+            "reload-scripts",
+            create_service='echo "${{reload_signal}}" > "{0}/${{service_name}}"',
+        )
+        supervisor.set_up("first", cwd="/srv/first", username="first", command="./first", reload_signal="HUP")
+        supervisor.set_up("second", cwd="/srv/second", username="second", command="./second")
+        
+        assert_equal("HUP\n", self._read_output("first"))
+        assert_equal("\n", self._read_output("second"))
+    
+    @istest
+    def install_script_is_only_run_once(self):
+        self.supervisor.install()
+        self.supervisor.install()
+        assert_equal("installed\n", self._read_output("install.log"))
+    
+    @istest
+    def error_if_setting_up_any_service_fails(self):
+        supervisor = self._create_supervisor(
+            "failing-scripts",
+            create_service='[ "${{service_name}}" != "second" ]',
+        )
+        try:
+            supervisor.set_up_many([
+                {"service_name": "first", "cwd": "/srv/first", "username": "first", "command": "./first"},
+                {"service_name": "second", "cwd": "/srv/second", "username": "second", "command": "./second"},
+            ])
+            assert False, "Expected RunProcessError"
+        except spur.RunProcessError:
+            pass
+    
+    def _create_supervisor(self, name, create_service):
+        scripts_dir = os.path.join(self._dir_path, name)
+        os.mkdir(scripts_dir)
+        scripts = {
+            "install": 'echo installed >> "{0}/install.log"',
+            "create-service": create_service,
+        }
+        for script_name, script in scripts.items():
+            with open(os.path.join(scripts_dir, script_name), "w") as script_file:
+                script_file.write(script.format(self._output_dir))
+        return supervisors.Supervisor(self._shell, scripts_dir)
+    
+    def _read_output(self, name):
+        with open(os.path.join(self._output_dir, name)) as output_file:
+            return output_file.read()
+
+
+@istest
+def stop_on_exit_sends_reload_signal_instead_of_restarting_if_command_is_unchanged():
+    dir_path = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(dir_path, "service"), "w") as service_file:
+            service_file.write("trap 'echo reloaded >> reloads' HUP\necho started >> starts\nwhile true; do sleep 0.05; done\n")
+        command = "sh service"
+        with supervisors.stop_on_exit() as supervisor:
+            supervisor.set_up("app", cwd=dir_path, username=None, command=command, reload_signal="HUP")
+            _wait_for_file(os.path.join(dir_path, "starts"))
+            supervisor.set_up("app", cwd=dir_path, username=None, command=command, reload_signal="HUP")
+            _wait_for_file(os.path.join(dir_path, "reloads"))
+        
+        with open(os.path.join(dir_path, "starts")) as starts_file:
+            assert_equal("started\n", starts_file.read())
+    finally:
+        shutil.rmtree(dir_path)
+
+
+@istest
+class PreforkTests(object):
+    def setup(self):
+        self._dir_path = tempfile.mkdtemp()
+        with open(os.path.join(self._dir_path, "worker.py"), "w") as worker_file:
+            worker_file.write(_prefork_worker)
+        self._port = _free_port()
+        self.supervisor = supervisors.prefork(workers=2)
+    
+    def teardown(self):
+        self.supervisor.close()
+        shutil.rmtree(self._dir_path)
+    
+    @istest
+    def workers_share_listening_socket(self):
+        self._set_up("v1")
+        
+        worker_pids = set(stats.pid for stats in self.supervisor.stats()["app"])
+        assert_equal(2, len(worker_pids))
+        version, pid = self._request()
+        assert_equal("v1", version)
+        assert pid in worker_pids
+    
+    @istest
+    def workers_are_replaced_without_refusing_connections(self):
+        self._set_up("v1")
+        old_pids = set(stats.pid for stats in self.supervisor.stats()["app"])
+        
+        responses = []
+        stopped = threading.Event()
+        def request_until_stopped():
+            while not stopped.is_set():
+                responses.append(self._request()[0])
+        requester = threading.Thread(target=request_until_stopped)
+        requester.start()
+        try:
+            self._set_up("v2")
+            time.sleep(0.2)
+        finally:
+            stopped.set()
+            requester.join()
+        
+        new_pids = set(stats.pid for stats in self.supervisor.stats()["app"])
+        assert_equal(2, len(new_pids))
+        assert not old_pids & new_pids
+        assert_equal("v2", responses[-1])
+    
+    @istest
+    def stats_include_cpu_time_and_memory_of_each_worker(self):
+        self._set_up("v1")
+        version, pid = self._request()
+        
+        stats = dict((stats.pid, stats) for stats in self.supervisor.stats()["app"])
+        assert_equal(2, len(stats))
+        assert stats[pid].cpu_seconds >= 0
+        assert stats[pid].rss_bytes > 0
+    
+    def _set_up(self, version):
+        self.supervisor.set_up(
+            "app",
+            cwd=self._dir_path,
+            username=None,
+            command="python worker.py {0}".format(version),
+            listen_port=self._port,
+        )
+    
+    def _request(self):
+        connection = socket.create_connection(("127.0.0.1", self._port), timeout=5)
+        try:
+            response = b""
+            while True:
+                data = connection.recv(4096)
+                if not data:
+                    break
+                response += data
+        finally:
+            connection.close()
+        version, pid = response.decode("ascii").split()
+        return version, int(pid)
+
+
+_prefork_worker = """
+import os
+import socket
+import sys
+
+listener = socket.fromfd(3, socket.AF_INET, socket.SOCK_STREAM)
+while True:
+    connection, address = listener.accept()
+    connection.sendall("{0} {1}".format(sys.argv[1], os.getpid()).encode("ascii"))
+    connection.close()
+"""
+
+
+def _free_port():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        listener.bind(("127.0.0.1", 0))
+        return listener.getsockname()[1]
+    finally:
+        listener.close()
+
+
+@istest
+def stop_on_exit_restarts_crashed_services_with_backoff():
+    dir_path = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(dir_path, "service"), "w") as service_file:
+            service_file.write("echo started >> starts\nexit 1\n")
+        with supervisors.StopOnExit(min_restart_delay=0.05, max_restart_delay=1) as supervisor:
+            supervisor.set_up("app", cwd=dir_path, username=None, command="sh service")
+            time.sleep(0.6)
+            restarts = supervisor.stats()["app"][0].restarts
+        
+        with open(os.path.join(dir_path, "starts")) as starts_file:
+            starts = len(starts_file.readlines())
+        # Restarts after 0.05s, 0.1s, 0.2s then 0.4s
+        assert 3 <= starts <= 5, starts
+        assert_equal(starts - 1, restarts)
+    finally:
+        shutil.rmtree(dir_path)
+
+
+@istest
+def stop_on_exit_keeps_restarting_services_that_fail_to_start():
+    dir_path = tempfile.mkdtemp()
+    try:
+        cwd = os.path.join(dir_path, "app")
+        starts_path = os.path.join(dir_path, "starts")
+        os.mkdir(cwd)
+        with supervisors.StopOnExit(min_restart_delay=0.05, max_restart_delay=0.2) as supervisor:
+            supervisor.set_up("app", cwd=cwd, username=None, command="echo started >> ../starts; exit 1")
+            _wait_for_file(starts_path)
+            os.rmdir(cwd)
+            time.sleep(0.3)
+            os.mkdir(cwd)
+            _wait_for(lambda: _count_lines(starts_path) >= 2)
+            restarts = supervisor.stats()["app"][0].restarts
+        
+        # At least one failed start and then a successful one
+        assert restarts >= 2, restarts
+    finally:
+        shutil.rmtree(dir_path)
+
+
+@istest
+def stop_on_exit_reports_uptime_and_memory_of_running_services():
+    dir_path = tempfile.mkdtemp()
+    try:
+        with supervisors.stop_on_exit() as supervisor:
+            supervisor.set_up("app", cwd=dir_path, username=None, command="sleep 5")
+            time.sleep(0.1)
+            stats, = supervisor.stats()["app"]
+        
+        assert stats.pid is not None
+        assert_equal(0, stats.restarts)
+        assert stats.uptime_seconds >= 0.1
+        assert 0 < stats.rss_bytes <= stats.peak_rss_bytes
+    finally:
+        shutil.rmtree(dir_path)
+
+
+def _wait_for_file(path):
+    _wait_for(lambda: os.path.exists(path), "Timed out waiting for " + path)
+
+
+def _wait_for(condition, message="Timed out"):
+    start_time = time.time()
+    while not condition():
+        assert time.time() - start_time < 5, message
+        time.sleep(0.01)
+
+
+def _count_lines(path):
+    with open(path) as lines_file:
+        return len(lines_file.readlines())
+
+
+class _CountingShell(object):
+    def __init__(self, shell):
+        self._shell = shell
+        self.commands = 0
+    
+    def run(self, *args, **kwargs):
+        self.commands += 1
+        return self._shell.run(*args, **kwargs)
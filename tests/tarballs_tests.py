@@ -1,11 +1,14 @@
 import errno
+import io
 import os
 import tempfile
 import tarfile
 import shutil
 import subprocess
+import sys
 
 from nose.tools import istest, assert_equal
+from nose.plugins.skip import SkipTest
 
 from beach import tarballs
 
@@ -47,6 +50,86 @@ def can_create_temporary_tarball_using_path_with_trailing_slash():
 
 
 
+@istest
+def temporary_tarball_can_be_uncompressed():
+    _assert_temporary_tarball_can_be_read(tarballs.Compression("none"), "r:")
+
+
+@istest
+def temporary_tarball_can_be_compressed_with_multithreaded_gzip():
+    _skip_unless_command_exists("pigz")
+    _assert_temporary_tarball_can_be_read(tarballs.Compression("gzip", threads=2), "r:gz")
+
+
+@istest
+def temporary_tarball_can_be_compressed_with_zstd():
+    _skip_unless_command_exists("zstd")
+    compression = tarballs.Compression("zstd", level=1, threads=0)
+    with _temp_hello_app() as path:
+        with tarballs.create_temp_tarball(path, compression=compression) as tarball:
+            output = subprocess.Popen(
+                ["tar", "-x", "--use-compress-program=zstd", "-O", "-f", tarball.name, "hello/message"],
+                stdout=subprocess.PIPE,
+            ).communicate()[0]
+            assert_equal(b"Greetings!", output)
+
+
+@istest
+def compression_level_of_zero_stores_data_uncompressed():
+    data = b"Greetings!" * 1000
+    output = io.BytesIO()
+    with tarballs.Compression("gzip", level=0).compress(output) as compressed:
+        compressed.write(data)
+    assert len(output.getvalue()) > len(data)
+
+
+@istest
+def importing_beach_does_not_import_multiprocessing():
+    # Run in a new interpreter since this one may already have imported it
+    code = "import sys, beach; assert 'multiprocessing' not in sys.modules, 'multiprocessing was imported'"
+    env = os.environ.copy()
+    env["PYTHONPATH"] = os.path.join(os.path.dirname(__file__), "..")
+    subprocess.check_call([sys.executable, "-c", code], env=env)
+
+
+@istest
+def error_if_compression_codec_is_not_recognised():
+    try:
+        tarballs.Compression("lzma")
+        assert False, "Expected ValueError"
+    except ValueError as error:
+        assert_equal("Unrecognised compression codec: lzma", str(error))
+
+
+def _assert_temporary_tarball_can_be_read(compression, mode):
+    with _temp_hello_app() as path:
+        with tarballs.create_temp_tarball(path, compression=compression) as tarball:
+            tarball_reader = tarfile.open(name=tarball.name, mode=mode)
+            message_file = tarball_reader.extractfile("hello/message")
+            assert_equal(b"Greetings!", message_file.read())
+
+
+class _temp_hello_app(object):
+    def __enter__(self):
+        self._dir_path = tempfile.mkdtemp()
+        path = os.path.join(self._dir_path, "hello")
+        os.mkdir(path)
+        with open(os.path.join(path, "message"), "w") as message_file:
+            message_file.write("Greetings!")
+        return path
+    
+    def __exit__(self, *args):
+        shutil.rmtree(self._dir_path)
+
+
+def _skip_unless_command_exists(name):
+    if not any(
+        os.access(os.path.join(path, name), os.X_OK)
+        for path in os.environ.get("PATH", "").split(os.pathsep)
+    ):
+        raise SkipTest("{0} is not installed".format(name))
+
+
 @istest
 def temporary_tarball_ignores_files_according_to_gitignore():
     temp_dir = tempfile.mkdtemp()
@@ -65,6 +148,59 @@ def temporary_tarball_ignores_files_according_to_gitignore():
     finally:
         shutil.rmtree(temp_dir)
 
+@istest
+def temporary_tarball_ignores_directories_according_to_gitignore():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(temp_dir, "repo")
+        os.mkdir(path)
+        _create_git_repo(
+            path=path,
+            filenames=["a", "node_modules/b/c", "node_modules/d"],
+            gitignore="/node_modules"
+        )
+        
+        with tarballs.create_temp_tarball(path) as tarball:
+            tarball_reader = tarfile.open(name=tarball.name)
+            assert_equal(set(["repo/.gitignore", "repo/a"]), set(tarball_reader.getnames()))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+@istest
+def git_filenames_include_tracked_and_untracked_files():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        _create_git_repo(path=temp_dir, filenames=["a", "b/c", "d"], gitignore="/d")
+        subprocess.check_call(["git", "add", "a"], cwd=temp_dir)
+        
+        assert_equal(
+            set([".gitignore", "a", os.path.join("b", "c")]),
+            set(tarballs.find_filenames(temp_dir)),
+        )
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+@istest
+def git_filenames_follow_changes_to_working_tree_that_leave_index_unchanged():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        _create_git_repo(path=temp_dir, filenames=["a", "b/c"], gitignore="")
+        subprocess.check_call(["git", "add", "a", "b/c"], cwd=temp_dir)
+        tarballs.find_filenames(temp_dir)
+        
+        os.remove(os.path.join(temp_dir, "a"))
+        _create_files(temp_dir, ["b/d"])
+        
+        assert_equal(
+            set([".gitignore", os.path.join("b", "c"), os.path.join("b", "d")]),
+            set(tarballs.find_filenames(temp_dir)),
+        )
+    finally:
+        shutil.rmtree(temp_dir)
+
+
 def _create_files(parent_path, filenames):
     for filename in filenames:
         path = os.path.join(parent_path, filename)
@@ -0,0 +1,78 @@
+import json
+import os
+import tempfile
+import shutil
+
+import spur
+from nose.tools import istest, assert_equal
+
+from beach import tracing
+
+
+@istest
+def spans_are_not_recorded_unless_tracer_is_started():
+    with tracing.span("deploy") as span:
+        span.set(files=1)
+    tracing.count("remote_commands")
+    
+    tracer = tracing.start()
+    tracing.stop()
+    assert_equal(["totals"], [event["name"] for event in tracer.events()])
+
+
+@istest
+def spans_are_recorded_with_their_args():
+    tracer = tracing.start()
+    try:
+        with tracing.span("deploy", app="web"):
+            with tracing.span("upload") as span:
+                span.set(files=3)
+    finally:
+        tracing.stop()
+    
+    events = tracer.events()
+    assert_equal(["deploy", "upload", "totals"], [event["name"] for event in events])
+    assert_equal({"app": "web"}, events[0]["args"])
+    assert_equal({"files": 3}, events[1]["args"])
+    assert events[0]["dur"] >= events[1]["dur"]
+
+
+@istest
+def tracing_shell_counts_commands_and_bytes_sent():
+    temp_dir = tempfile.mkdtemp()
+    tracer = tracing.start()
+    try:
+        shell = tracing.TracingShell(spur.LocalShell())
+        shell.run(["true"])
+        with shell.open(os.path.join(temp_dir, "message"), "w") as message_file:
+            message_file.write("hello")
+        process = shell.spawn(["head", "-c", "3"])
+        process.stdin_write(b"abc")
+        process.wait_for_result()
+    finally:
+        tracing.stop()
+        shutil.rmtree(temp_dir)
+    
+    assert_equal({"remote_commands": 2, "bytes_sent": 8}, tracer.counters)
+
+
+@istest
+def trace_can_be_written_as_json_lines_or_chrome_trace():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        tracer = tracing.start()
+        with tracing.span("deploy"):
+            tracing.count("remote_commands", 2)
+        tracing.stop()
+        
+        tracer.write(os.path.join(temp_dir, "trace.jsonl"))
+        with open(os.path.join(temp_dir, "trace.jsonl")) as trace_file:
+            events = [json.loads(line) for line in trace_file]
+        assert_equal(["deploy", "totals"], [event["name"] for event in events])
+        assert_equal({"remote_commands": 2}, events[1]["args"])
+        
+        tracer.write(os.path.join(temp_dir, "trace.json"))
+        with open(os.path.join(temp_dir, "trace.json")) as trace_file:
+            assert_equal(events, json.load(trace_file)["traceEvents"])
+    finally:
+        shutil.rmtree(temp_dir)
@@ -0,0 +1,142 @@
+import os
+import tempfile
+import shutil
+
+import spur
+from nose.tools import istest, assert_equal, assert_raises
+
+from beach import uploads, tarballs
+
+
+@istest
+def tarball_uploader_copies_files_into_destination():
+    with _temp_dir() as temp_dir:
+        app_path = _create_app(temp_dir, {"message": "Greetings!"})
+        destination = os.path.join(temp_dir, "destination")
+        
+        uploads.TarballUploader(spur.LocalShell()).upload(app_path, destination)
+        
+        assert_equal("Greetings!", _read_file(os.path.join(destination, "message")))
+
+
+@istest
+def content_addressed_uploader_copies_files_into_destination():
+    with _temp_dir() as temp_dir:
+        app_path = _create_app(temp_dir, {"message": "Greetings!", "lib/greet": "Hello"})
+        store_path = os.path.join(temp_dir, "store")
+        destination = os.path.join(temp_dir, "destination")
+        
+        uploader = uploads.ContentAddressedUploader(spur.LocalShell(), store_path)
+        uploader.upload(app_path, destination)
+        
+        assert_equal("Greetings!", _read_file(os.path.join(destination, "message")))
+        assert_equal("Hello", _read_file(os.path.join(destination, "lib/greet")))
+
+
+@istest
+def content_addressed_uploader_preserves_file_modes_and_symlinks():
+    with _temp_dir() as temp_dir:
+        app_path = _create_app(temp_dir, {"run": "#!/bin/sh"})
+        os.chmod(os.path.join(app_path, "run"), 0o755)
+        os.symlink("run", os.path.join(app_path, "start"))
+        store_path = os.path.join(temp_dir, "store")
+        destination = os.path.join(temp_dir, "destination")
+        
+        uploader = uploads.ContentAddressedUploader(spur.LocalShell(), store_path)
+        uploader.upload(app_path, destination)
+        
+        assert os.access(os.path.join(destination, "run"), os.X_OK)
+        assert_equal("run", os.readlink(os.path.join(destination, "start")))
+
+
+@istest
+def content_addressed_uploader_only_stores_new_content_once():
+    with _temp_dir() as temp_dir:
+        app_path = _create_app(temp_dir, {"a": "one", "b": "two"})
+        store_path = os.path.join(temp_dir, "store")
+        uploader = uploads.ContentAddressedUploader(spur.LocalShell(), store_path)
+        
+        uploader.upload(app_path, os.path.join(temp_dir, "first"))
+        _create_app(temp_dir, {"a": "three"})
+        uploader.upload(app_path, os.path.join(temp_dir, "second"))
+        
+        assert_equal(3, len(os.listdir(store_path)))
+        assert_equal(
+            os.stat(os.path.join(temp_dir, "first/b")).st_ino,
+            os.stat(os.path.join(temp_dir, "second/b")).st_ino,
+        )
+        assert_equal("three", _read_file(os.path.join(temp_dir, "second/a")))
+
+
+@istest
+def content_addressed_uploader_does_not_keep_objects_from_interrupted_upload():
+    with _temp_dir() as temp_dir:
+        large_contents = "Greetings!" * 300000
+        app_path = _create_app(temp_dir, {"a": large_contents, "b": "Hello"})
+        store_path = os.path.join(temp_dir, "store")
+        uploader = uploads.ContentAddressedUploader(
+            spur.LocalShell(),
+            store_path,
+            compression=tarballs.Compression("none"),
+        )
+        
+        # Removing b after taking the snapshot interrupts the upload after
+        # only part of a has been sent
+        snapshot = uploads.create_snapshot(app_path)
+        os.remove(os.path.join(app_path, "b"))
+        assert_raises(OSError, lambda: uploader.upload(app_path, os.path.join(temp_dir, "first"), snapshot=snapshot))
+        
+        _create_app(temp_dir, {"b": "Hello"})
+        uploader.upload(app_path, os.path.join(temp_dir, "second"))
+        
+        assert _read_file(os.path.join(temp_dir, "second/a")) == large_contents
+
+
+@istest
+def snapshot_hash_depends_on_file_contents():
+    with _temp_dir() as temp_dir:
+        app_path = _create_app(temp_dir, {"a": "one"})
+        first_hash = uploads.create_snapshot(app_path).hash
+        assert_equal(first_hash, uploads.create_snapshot(app_path).hash)
+        _create_app(temp_dir, {"a": "two"})
+        assert first_hash != uploads.create_snapshot(app_path).hash
+
+
+def _create_app(parent_path, files):
+    app_path = os.path.join(parent_path, "app")
+    for name, contents in files.items():
+        path = os.path.join(app_path, name)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as target:
+            target.write(contents)
+    return app_path
+
+
+def _read_file(path):
+    with open(path) as f:
+        return f.read()
+
+
+class _temp_dir(object):
+    def __enter__(self):
+        self._path = tempfile.mkdtemp()
+        return self._path
+    
+    def __exit__(self, *args):
+        shutil.rmtree(self._path)
+
+
+@istest
+def uploads_can_be_sent_uncompressed():
+    with _temp_dir() as temp_dir:
+        app_path = _create_app(temp_dir, {"message": "Greetings!"})
+        compression = tarballs.Compression("none")
+        uploaders = [
+            uploads.TarballUploader(spur.LocalShell(), compression=compression),
+            uploads.ContentAddressedUploader(spur.LocalShell(), os.path.join(temp_dir, "store"), compression=compression),
+        ]
+        for index, uploader in enumerate(uploaders):
+            destination = os.path.join(temp_dir, "destination-{0}".format(index))
+            uploader.upload(app_path, destination)
+            assert_equal("Greetings!", _read_file(os.path.join(destination, "message")))
@@ -0,0 +1,77 @@
+import threading
+import time
+
+from nose.tools import istest, assert_equal
+
+import beach
+
+
+@istest
+def dependents_are_updated_once_for_changes_made_together():
+    registry = beach.registries.InMemoryRegistry()
+    deployer = _FakeDeployer()
+    stopped = threading.Event()
+    watcher = threading.Thread(target=lambda: beach.watching.watch(
+        deployer,
+        registry,
+        batch_delay=0.2,
+        poll_interval=0.01,
+        stop=stopped.is_set,
+    ))
+    watcher.start()
+    try:
+        time.sleep(0.1)
+        registry.register("db", provides={"url": "db-1"})
+        registry.register("cache", provides={"url": "cache-1"})
+        _wait_for(lambda: deployer.updates == 1)
+        time.sleep(0.3)
+        assert_equal(1, deployer.updates)
+    finally:
+        stopped.set()
+        watcher.join()
+
+
+@istest
+def watching_continues_after_update_fails():
+    registry = beach.registries.InMemoryRegistry()
+    deployer = _FakeDeployer(failures=1)
+    errors = []
+    stopped = threading.Event()
+    watcher = threading.Thread(target=lambda: beach.watching.watch(
+        deployer,
+        registry,
+        batch_delay=0,
+        poll_interval=0.01,
+        stop=stopped.is_set,
+        on_error=errors.append,
+    ))
+    watcher.start()
+    try:
+        time.sleep(0.1)
+        registry.register("db", provides={"url": "db-1"})
+        _wait_for(lambda: deployer.updates == 1)
+        registry.register("db", provides={"url": "db-2"})
+        _wait_for(lambda: deployer.updates == 2)
+        assert_equal(["update failed"], [str(error) for error in errors])
+    finally:
+        stopped.set()
+        watcher.join()
+
+
+class _FakeDeployer(object):
+    def __init__(self, failures=0):
+        self.updates = 0
+        self._failures = failures
+    
+    def update_dependents(self):
+        self.updates += 1
+        if self.updates <= self._failures:
+            raise Exception("update failed")
+        return []
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)